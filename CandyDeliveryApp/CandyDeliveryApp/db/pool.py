@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, check, reset, max_size=10, timeout=5, health_check_interval=30):
+        self.connect = connect
+        self.check = check
+        self.reset = reset
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def acquire(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout('No free connection in the pool after %s seconds' % self.timeout)
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    connection, released_at = self.idle.pop()
+                if self.is_healthy(connection, released_at):
+                    return connection
+                self.discard(connection)
+            return self.connect()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def is_healthy(self, connection, released_at):
+        if time.monotonic() - released_at < self.health_check_interval:
+            return not connection.closed
+        try:
+            return self.check(connection)
+        except Exception:
+            return False
+
+    def release(self, connection):
+        try:
+            if self.reset(connection):
+                with self.lock:
+                    self.idle.append((connection, time.monotonic()))
+            else:
+                self.discard(connection)
+        finally:
+            self.slots.release()
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self.discard(connection)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 import os
 import environ
+from django.core.exceptions import ImproperlyConfigured
 env = environ.Env()
 environ.Env.read_env()
 
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -88,6 +90,25 @@ else:
     DATABASES = {
         'default': env.db()
     }
+    # Seconds to keep a connection open between requests (0 closes it after each request)
+    DATABASES['default']['CONN_MAX_AGE'] = env.int('DB_CONN_MAX_AGE', default=60)
+    # Optional per-process pool: connections go back to the pool after each request and
+    # MAX_SIZE caps how many connections a single worker may hold
+    if env.bool('DB_POOL_ENABLED', default=False):
+        DATABASES['default'].update({
+            'ENGINE': 'CandyDeliveryApp.db.postgresql_pool',
+            'CONN_MAX_AGE': 0,
+            'POOL': {
+                'MAX_SIZE': env.int('DB_POOL_MAX_SIZE', default=10),
+                'TIMEOUT': env.float('DB_POOL_TIMEOUT', default=5),
+                'HEALTH_CHECK_INTERVAL': env.float('DB_POOL_HEALTH_CHECK_INTERVAL', default=30),
+            },
+        })
+
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://?MAX_ENTRIES=100000')
+}
 
 
 # Password validation
@@ -127,3 +148,72 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.1/howto/static-files/
 STATIC_URL = '/static/'
 STATICFILES_DIRS = (os.path.join(BASE_DIR, 'static/'),)
+
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+
+# Serve the API with async views that run the handlers in a bounded thread pool
+# (ASGI deployments only)
+API_ASYNC_VIEWS = env.bool('API_ASYNC_VIEWS', default=False)
+ASYNC_VIEWS_THREADS = env.int('ASYNC_VIEWS_THREADS', default=16)
+ASYNC_STREAM_BUFFER = env.int('ASYNC_STREAM_BUFFER', default=64)
+
+
+# Bulk import
+BULK_IMPORT_BATCH_SIZE = env.int('BULK_IMPORT_BATCH_SIZE', default=1000)
+
+
+# Order listing
+ORDER_LIST_PAGE_SIZE = env.int('ORDER_LIST_PAGE_SIZE', default=100)
+ORDER_LIST_MAX_PAGE_SIZE = env.int('ORDER_LIST_MAX_PAGE_SIZE', default=1000)
+
+
+# Completed orders older than ORDER_RETENTION_DAYS are moved to the archive table
+# by the archive_orders command
+ORDER_RETENTION_DAYS = env.int('ORDER_RETENTION_DAYS', default=90)
+ARCHIVE_BATCH_SIZE = env.int('ARCHIVE_BATCH_SIZE', default=1000)
+
+
+# Order assignment
+ASSIGNMENT_STRATEGY = env.str('ASSIGNMENT_STRATEGY', default='lightest_first')
+ASSIGNMENT_TIME_BUDGET = env.float('ASSIGNMENT_TIME_BUDGET', default=0.05)
+# Candidates are packed without locks, packed orders taken by a concurrent
+# assignment are dropped and the rest of the capacity re-packed up to this many times
+ASSIGNMENT_LOCK_ATTEMPTS = env.int('ASSIGNMENT_LOCK_ATTEMPTS', default=3)
+
+# In-process index of unassigned orders used to find assignment candidates,
+# rebuilt in the background after DISPATCH_INDEX_MAX_AGE seconds
+DISPATCH_INDEX_ENABLED = env.bool('DISPATCH_INDEX_ENABLED', default=False)
+DISPATCH_INDEX_MAX_AGE = env.int('DISPATCH_INDEX_MAX_AGE', default=300)
+
+
+# Per-endpoint latency, query and stage metrics served at /metrics/ in Prometheus format,
+# optionally also sent to clients in a Server-Timing header
+METRICS_ENABLED = env.bool('METRICS_ENABLED', default=True)
+METRICS_SERVER_TIMING = env.bool('METRICS_SERVER_TIMING', default=False)
+
+
+# Cache of GET /couriers/<id> responses, invalidated when the courier or its orders change.
+# Invalidation only reaches other workers and management commands through a shared cache
+# (CACHE_URL pointing at memcached or redis), so the per-process locmem cache is refused outside DEBUG
+COURIER_CACHE_ENABLED = env.bool('COURIER_CACHE_ENABLED', default=False)
+COURIER_CACHE_ALIAS = env.str('COURIER_CACHE_ALIAS', default='default')
+COURIER_CACHE_TIMEOUT = env.int('COURIER_CACHE_TIMEOUT', default=3600)
+if COURIER_CACHE_ENABLED and not DEBUG and CACHES[COURIER_CACHE_ALIAS]['BACKEND'].endswith('.LocMemCache'):
+    raise ImproperlyConfigured('COURIER_CACHE_ENABLED needs a cache shared between processes, set CACHE_URL')
+
+
+# Courier rating: 'stats' reads the incremental per-region aggregates,
+# 'sql' computes it from the orders table with window functions
+COURIER_RATING_SOURCE = env.str('COURIER_RATING_SOURCE', default='stats')
@@ -0,0 +1,70 @@
+import math
+import time
+
+from django.conf import settings
+
+WEIGHT_UNITS = 100
+
+
+def to_units(weight):
+    return max(1, math.ceil(round(weight * WEIGHT_UNITS, 6)))
+
+
+def order_key(order):
+    return order.region, order.first_start
+
+
+def pack_greedy(orders, capacity):
+    chosen = []
+    for order in orders:
+        weight = to_units(order.weight)
+        if weight <= capacity:
+            chosen.append(order)
+            capacity -= weight
+    return chosen
+
+
+def pack_lightest_first(orders, capacity, deadline=None):
+    return pack_greedy(sorted(orders, key=lambda i: (i.weight,) + order_key(i)), capacity)
+
+
+def pack_first_fit_decreasing(orders, capacity, deadline=None):
+    return pack_greedy(sorted(orders, key=lambda i: (-i.weight,) + order_key(i)), capacity)
+
+
+def pack_knapsack(orders, capacity, deadline=None):
+    orders = sorted(orders, key=order_key)
+    weights = [to_units(i.weight) for i in orders]
+    mask = (1 << (capacity + 1)) - 1
+    reachable = 1
+    history = []
+    for weight in weights:
+        if deadline is not None and time.perf_counter() > deadline:
+            return pack_first_fit_decreasing(orders, capacity)
+        history.append(reachable)
+        reachable = (reachable | (reachable << weight)) & mask
+    total = reachable.bit_length() - 1
+    chosen = []
+    for i in range(len(orders) - 1, -1, -1):
+        if not (history[i] >> total) & 1:
+            chosen.append(orders[i])
+            total -= weights[i]
+    return chosen
+
+
+STRATEGIES = {
+    'lightest_first': pack_lightest_first,
+    'first_fit_decreasing': pack_first_fit_decreasing,
+    'knapsack': pack_knapsack,
+}
+
+
+def pack_orders(orders, capacity, strategy=None, time_budget=None):
+    strategy = STRATEGIES[strategy or settings.ASSIGNMENT_STRATEGY]
+    time_budget = settings.ASSIGNMENT_TIME_BUDGET if time_budget is None else time_budget
+    capacity = int(round(capacity * WEIGHT_UNITS, 6))
+    if sum(to_units(i.weight) for i in orders) <= capacity:
+        chosen = list(orders)
+    else:
+        chosen = strategy(orders, capacity, time.perf_counter() + time_budget)
+    return sorted(chosen, key=lambda i: i.order_id)
@@ -0,0 +1,4 @@
+from . import async_views
+from .urls import build_urlpatterns
+
+urlpatterns = build_urlpatterns(async_views)
@@ -0,0 +1,107 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers import asgi
+from django.db import close_old_connections
+
+from . import views
+
+executor = None
+
+
+def get_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=settings.ASYNC_VIEWS_THREADS, thread_name_prefix='api-view')
+    return executor
+
+
+def run_view(view, request, *args, **kwargs):
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if not response.streaming:
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+async def stream_in_executor(content, context):
+    # The ORM can't be used from the event loop, so the whole stream is read in one worker thread
+    # and handed over at most ASYNC_STREAM_BUFFER chunks ahead of the client
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+    credits = threading.Semaphore(settings.ASYNC_STREAM_BUFFER)
+    stopped = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for chunk in content:
+                credits.acquire()
+                if stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+        finally:
+            close_old_connections()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    future = loop.run_in_executor(get_executor(), context.run, produce)
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            credits.release()
+            yield chunk
+        await future
+    finally:
+        stopped.set()
+        credits.release()
+
+
+def async_view(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        context = contextvars.copy_context()
+        response = await loop.run_in_executor(
+            get_executor(), functools.partial(context.run, run_view, view, request, *args, **kwargs)
+        )
+        if response.streaming:
+            response.async_streaming_content = stream_in_executor(response.streaming_content, context)
+        return response
+    return wrapper
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    # Django 3.1 iterates streaming responses on the event loop, so streams of the async views are sent from here
+    async def send_response(self, response, send):
+        chunks = getattr(response, 'async_streaming_content', None)
+        if chunks is None:
+            return await super().send_response(response, send)
+
+        async def send_chunks(message):
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                async for chunk in chunks:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send(message)
+
+        response.streaming_content = []
+        await super().send_response(response, send_chunks)
+
+
+api_cache_stats = async_view(views.api_cache_stats)
+api_couriers = async_view(views.api_couriers)
+api_couriers_detail = async_view(views.api_couriers_detail)
+api_couriers_orders = async_view(views.api_couriers_orders)
+api_orders = async_view(views.api_orders)
+api_orders_stream = async_view(views.api_orders_stream)
+api_orders_assign = async_view(views.api_orders_assign)
+api_orders_complete = async_view(views.api_orders_complete)
+api_orders_dispatch = async_view(views.api_orders_dispatch)
@@ -0,0 +1,229 @@
+import json
+import random
+import time
+from datetime import datetime as dt
+
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from orders.models import COURIERS_TYPE_AND_WEIGHT_MAPPING, Order
+from rest_framework import serializers
+
+from .assignment import STRATEGIES, pack_orders
+from .factories import courier_data, format_hours, order_data
+from .serializers import CourierSerializer, OrderSerializer
+from .validators import validate_time_ranges
+
+SUITES = {}
+
+
+def register(name):
+    def decorator(func):
+        SUITES[name] = func
+        return func
+    return decorator
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, {'best': min(timings), 'mean': sum(timings) / len(timings)}
+
+
+def latency_summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+    }
+
+
+def make_orders(size, max_weight, seed=0):
+    rnd = random.Random(seed)
+    orders = []
+    for order_id in range(1, size + 1):
+        start = rnd.randrange(8 * 60, 20 * 60, 30)
+        order = Order(
+            order_id=order_id, weight=round(rnd.uniform(0.01, max_weight), 2), region=rnd.randint(1, 10),
+            delivery_hours=[format_hours(start, start + rnd.choice([30, 60, 120]))]
+        )
+        order.compile_hours()
+        orders.append(order)
+    return orders
+
+
+def legacy_greedy(orders, capacity):
+    return [i for i in orders if i.weight <= capacity]
+
+
+@register('assignment')
+def benchmark_assignment(sizes, repeat):
+    results = []
+    for courier_type, capacity in COURIERS_TYPE_AND_WEIGHT_MAPPING.items():
+        for size in sizes:
+            orders = make_orders(size, capacity)
+            cases = {'legacy_greedy': lambda: legacy_greedy(orders, capacity)}
+            for strategy in STRATEGIES:
+                cases[strategy] = lambda strategy=strategy: pack_orders(orders, capacity, strategy=strategy)
+            for case, func in cases.items():
+                chosen, timings = measure(func, repeat)
+                weight = sum(i.weight for i in chosen)
+                results.append({
+                    'suite': 'assignment', 'case': case, 'courier_type': courier_type, 'size': size,
+                    'orders': len(chosen), 'weight': round(weight, 2), 'over_capacity': weight > capacity,
+                    'seconds': timings
+                })
+    return results
+
+
+def legacy_validate_time_ranges(value):
+    for i in value:
+        if not isinstance(i, str):
+            raise serializers.ValidationError('The array must be composed of strings')
+        try:
+            dt.strptime(i[:5:], '%H:%M')
+            dt.strptime(i[6::], '%H:%M')
+        except ValueError:
+            raise serializers.ValidationError('The format of the array elements is incorrect')
+    return value
+
+
+def make_payloads(size, seed=0):
+    rnd = random.Random(seed)
+    couriers = []
+    orders = []
+    for i in range(1, size + 1):
+        start = rnd.randrange(6 * 60, 16 * 60, 15)
+        hours = [format_hours(start, start + 120), format_hours(start + 180, start + 360)]
+        couriers.append({
+            'courier_id': i, 'courier_type': rnd.choice(list(COURIERS_TYPE_AND_WEIGHT_MAPPING)),
+            'regions': rnd.sample(range(1, 30), 3), 'working_hours': hours
+        })
+        orders.append({
+            'order_id': i, 'weight': round(rnd.uniform(0.01, 50), 2), 'region': rnd.randint(1, 30),
+            'delivery_hours': hours
+        })
+    return couriers, orders
+
+
+@register('validation')
+def benchmark_validation(sizes, repeat):
+    results = []
+    for size in sizes:
+        couriers, orders = make_payloads(size)
+        hours = [i['working_hours'] for i in couriers]
+        cases = {
+            'legacy_time_ranges': (hours, legacy_validate_time_ranges),
+            'time_ranges': (hours, validate_time_ranges),
+            'courier_serializer': (couriers, CourierSerializer(many=True).child.run_validation),
+            'order_serializer': (orders, OrderSerializer(many=True).child.run_validation),
+        }
+        for case, (items, validate) in cases.items():
+            _, timings = measure(lambda: [validate(i) for i in items], repeat)
+            results.append({
+                'suite': 'validation', 'case': case, 'size': size,
+                'seconds': timings, 'seconds_per_item': timings['best'] / size
+            })
+    return results
+
+
+def run_query(reconnect):
+    if reconnect:
+        connection.close()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+
+@register('connections')
+def benchmark_connections(sizes, repeat):
+    results = []
+    for size in sizes:
+        for case, reconnect in (('reconnect', True), ('persistent', False)):
+            _, timings = measure(lambda: [run_query(reconnect) for _ in range(size)], repeat)
+            results.append({
+                'suite': 'connections', 'case': case, 'engine': connection.settings_dict['ENGINE'],
+                'size': size, 'seconds': timings, 'seconds_per_query': timings['best'] / size
+            })
+    connection.close()
+    return results
+
+
+# Keeps the seeded rows clear of real data; everything is rolled back afterwards
+FIRST_BENCHMARK_ID = 10 ** 9
+
+
+def call_endpoint(client, method, path, data=None):
+    if data is None:
+        start = time.perf_counter()
+        response = getattr(client, method)(path)
+    else:
+        data = json.dumps(data)
+        start = time.perf_counter()
+        response = getattr(client, method)(path, data=data, content_type='application/json')
+    elapsed = time.perf_counter() - start
+    assert response.status_code < 400, response.content[:500]
+    return response, elapsed
+
+
+def run_requests(client, method, requests):
+    latencies = []
+    responses = []
+    start = time.perf_counter()
+    for path, data in requests:
+        response, elapsed = call_endpoint(client, method, path, data)
+        responses.append(response)
+        latencies.append(elapsed)
+    return responses, (len(requests), latencies, time.perf_counter() - start)
+
+
+def summarize_runs(runs):
+    best = min(runs, key=lambda i: i[2])
+    seconds = {'best': best[2], 'mean': sum(i[2] for i in runs) / len(runs)}
+    count, latencies, elapsed = best
+    if latencies is None:
+        return {'items': count, 'seconds': seconds, 'items_per_second': round(count / elapsed, 1)}
+    return dict(latency_summary(latencies, elapsed), seconds=seconds)
+
+
+def run_api_cases(client, size, sample):
+    rnd = random.Random(size)
+    couriers = [courier_data(FIRST_BENCHMARK_ID + i, rnd) for i in range(max(1, size // 10))]
+    orders = [order_data(FIRST_BENCHMARK_ID + i, rnd) for i in range(size)]
+    sampled = [i['courier_id'] for i in couriers[:sample]]
+    cases = {}
+    with transaction.atomic():
+        for case, path, items in (('import_couriers', '/couriers/', couriers), ('import_orders', '/orders/', orders)):
+            _, elapsed = call_endpoint(client, 'post', path, items)
+            cases[case] = len(items), None, elapsed
+        responses, cases['assign'] = run_requests(
+            client, 'post', [('/orders/assign/', {'courier_id': i}) for i in sampled]
+        )
+        completions = [
+            ('/orders/complete/', {'courier_id': courier_id, 'order_id': response.data['orders'][0]['id'],
+                                   'complete_time': response.data['assign_time']})
+            for courier_id, response in zip(sampled, responses) if response.data['orders']
+        ]
+        if completions:
+            cases['complete'] = run_requests(client, 'post', completions)[1]
+        details = [('/couriers/%d/' % i, None) for i in sampled]
+        with override_settings(COURIER_CACHE_ENABLED=False):
+            cases['courier_detail'] = run_requests(client, 'get', details)[1]
+        transaction.set_rollback(True)
+    return cases
+
+
+@register('api')
+def benchmark_api(sizes, repeat, sample=200):
+    results = []
+    client = Client()
+    for size in sizes:
+        # Every run seeds the same data and is rolled back, cases report the fastest run
+        runs = [run_api_cases(client, size, sample) for _ in range(repeat)]
+        for case in runs[0]:
+            summary = summarize_runs([i[case] for i in runs if case in i])
+            results.append(dict({'suite': 'api', 'case': case, 'size': size}, **summary))
+    return results
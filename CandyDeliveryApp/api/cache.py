@@ -0,0 +1,70 @@
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+counters_lock = threading.Lock()
+
+
+def count(name, value=1):
+    with counters_lock:
+        counters[name] += value
+
+
+def get_cache():
+    return caches[settings.COURIER_CACHE_ALIAS]
+
+
+def profile_key(courier_id):
+    return 'courier:%d:profile' % courier_id
+
+
+def version_key(courier_id):
+    return 'courier:%d:version' % courier_id
+
+
+def get_courier_profile(courier_id):
+    if not settings.COURIER_CACHE_ENABLED:
+        return None, None
+    cache = get_cache()
+    keys = profile_key(courier_id), version_key(courier_id)
+    values = cache.get_many(keys)
+    version = values.get(keys[1])
+    cached = values.get(keys[0])
+    # Invalidation replaces the version, so a profile computed before it never matches again
+    if version is not None and cached is not None and cached[0] == version:
+        count('hits')
+        return cached[1], version
+    count('misses')
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(keys[1], version, None):
+            version = cache.get(keys[1])
+    return None, version
+
+
+def set_courier_profile(courier_id, version, profile):
+    if version is not None:
+        get_cache().set(profile_key(courier_id), (version, profile), settings.COURIER_CACHE_TIMEOUT)
+
+
+def bump_versions(courier_ids):
+    get_cache().set_many({version_key(i): uuid.uuid4().hex for i in courier_ids}, None)
+    count('invalidations', len(courier_ids))
+
+
+def invalidate_couriers(courier_ids):
+    courier_ids = list(courier_ids)
+    if settings.COURIER_CACHE_ENABLED and courier_ids:
+        transaction.on_commit(lambda: bump_versions(courier_ids))
+
+
+def get_stats():
+    with counters_lock:
+        stats = dict(counters)
+    requests = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / requests, 4) if requests else None
+    return stats
@@ -0,0 +1,175 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connection
+from orders.models import COURIERS_TYPE_AND_WEIGHT_MAPPING, Order
+
+WEIGHT_CLASSES = sorted(set(COURIERS_TYPE_AND_WEIGHT_MAPPING.values()))
+
+IndexedOrder = namedtuple('IndexedOrder', ('order_id', 'weight', 'region', 'first_start'))
+
+
+def weight_class(weight):
+    for i, limit in enumerate(WEIGHT_CLASSES):
+        if weight <= limit:
+            return i
+    return len(WEIGHT_CLASSES)
+
+
+class Bucket:
+    __slots__ = ('starts', 'ends', 'order_ids', 'weights', 'firsts', 'max_length', 'is_sorted')
+
+    def __init__(self):
+        self.starts = array('H')
+        self.ends = array('H')
+        self.order_ids = array('q')
+        self.weights = array('d')
+        self.firsts = array('H')
+        self.max_length = 0
+        self.is_sorted = True
+
+    def __len__(self):
+        return len(self.order_ids)
+
+    def add(self, order_id, weight, intervals):
+        for start, end in intervals:
+            if self.starts and start < self.starts[-1]:
+                self.is_sorted = False
+            self.starts.append(start)
+            self.ends.append(end)
+            self.order_ids.append(order_id)
+            self.weights.append(weight)
+            self.firsts.append(intervals[0][0])
+            self.max_length = max(self.max_length, end - start)
+
+    def rebuild(self, removed=()):
+        entries = sorted(
+            i for i in zip(self.starts, self.ends, self.order_ids, self.weights, self.firsts) if i[2] not in removed
+        )
+        self.starts = array('H', (i[0] for i in entries))
+        self.ends = array('H', (i[1] for i in entries))
+        self.order_ids = array('q', (i[2] for i in entries))
+        self.weights = array('d', (i[3] for i in entries))
+        self.firsts = array('H', (i[4] for i in entries))
+        self.is_sorted = True
+
+    def find(self, region, intervals, max_weight, removed, found):
+        if not self.is_sorted:
+            self.rebuild()
+        for start, end in intervals:
+            first = bisect_left(self.starts, start - self.max_length + 1)
+            last = bisect_left(self.starts, end)
+            for i in range(first, last):
+                order_id = self.order_ids[i]
+                if self.ends[i] > start and self.weights[i] <= max_weight and order_id not in removed:
+                    found[order_id] = IndexedOrder(order_id, self.weights[i], region, self.firsts[i])
+
+
+class DispatchIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.buckets = {}
+        self.removed = set()
+        self.built_at = None
+        self.journal = None
+
+    @property
+    def warm(self):
+        return self.built_at is not None
+
+    @property
+    def expired(self):
+        return self.warm and time.monotonic() - self.built_at > settings.DISPATCH_INDEX_MAX_AGE
+
+    def __len__(self):
+        return sum(len(i) for i in self.buckets.values())
+
+    def _add(self, buckets, order_id, weight, region, intervals):
+        key = (region, weight_class(weight))
+        if key not in buckets:
+            buckets[key] = Bucket()
+        buckets[key].add(order_id, weight, intervals)
+
+    def build(self):
+        with self.lock:
+            if self.journal is None:
+                self.journal = []
+        buckets = {}
+        orders = Order.objects.filter(courier=None).values_list('order_id', 'weight', 'region', 'delivery_intervals')
+        for order_id, weight, region, intervals in orders.iterator(chunk_size=10000):
+            self._add(buckets, order_id, weight, region, intervals or [])
+        for bucket in buckets.values():
+            bucket.rebuild()
+        with self.lock:
+            journal, self.journal = self.journal, None
+            self.buckets = buckets
+            self.removed = set()
+            self.built_at = time.monotonic()
+            for method, args in journal:
+                method(*args)
+
+    def warm_up(self):
+        with self.lock:
+            if self.journal is not None:
+                return
+            self.journal = []
+
+        def run():
+            try:
+                self.build()
+            finally:
+                connection.close()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def add(self, orders):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((self.add, (orders,)))
+            if not self.warm:
+                return
+            for order in orders:
+                self.removed.discard(order.order_id)
+                self._add(self.buckets, order.order_id, order.weight, order.region, order.delivery_intervals or [])
+
+    def discard(self, order_ids):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.append((self.discard, (order_ids,)))
+            if not self.warm:
+                return
+            self.removed.update(order_ids)
+            if len(self.removed) * 4 > len(self):
+                for bucket in self.buckets.values():
+                    bucket.rebuild(self.removed)
+                self.removed = set()
+
+    def candidates(self, courier):
+        if not settings.DISPATCH_INDEX_ENABLED:
+            return None
+        if not self.warm or self.expired:
+            self.warm_up()
+        if not self.warm:
+            return None
+        capacity = COURIERS_TYPE_AND_WEIGHT_MAPPING[courier.courier_type]
+        found = {}
+        with self.lock:
+            for region in set(courier.regions or []):
+                for i in range(weight_class(capacity) + 1):
+                    bucket = self.buckets.get((region, i))
+                    if bucket is not None:
+                        bucket.find(region, courier.working_intervals, capacity, self.removed, found)
+        return list(found.values())
+
+    def verify(self):
+        with self.lock:
+            indexed = {i for bucket in self.buckets.values() for i in bucket.order_ids} - self.removed
+        unassigned = set(Order.objects.filter(courier=None).values_list('order_id', flat=True))
+        return {'missing': len(unassigned - indexed), 'stale': len(indexed - unassigned)}
+
+
+dispatch_index = DispatchIndex()
@@ -0,0 +1,85 @@
+from collections import defaultdict
+from datetime import datetime as dt
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone as tz
+from orders.intervals import intervals_overlap
+from orders.models import (COURIERS_TYPE_AND_WEIGHT_MAPPING, Courier,
+                           CourierRegion, Order)
+
+from .assignment import pack_orders
+from .cache import invalidate_couriers
+from .dispatch_index import dispatch_index
+from .metrics import stage
+
+
+def build_region_index(orders):
+    index = defaultdict(list)
+    for order in orders:
+        if order.delivery_intervals:
+            index[order.region].append(order)
+    for bucket in index.values():
+        bucket.sort(key=lambda i: i.delivery_intervals[0][0])
+    return index
+
+
+def find_candidates(courier, index, taken):
+    capacity = COURIERS_TYPE_AND_WEIGHT_MAPPING[courier.courier_type]
+    working_intervals = courier.working_intervals
+    if not working_intervals:
+        return []
+    last_end = working_intervals[-1][1]
+    candidates = []
+    for region in set(courier.regions or []):
+        for order in index.get(region, ()):
+            if order.delivery_intervals[0][0] >= last_end:
+                break
+            if order.order_id in taken or order.weight > capacity:
+                continue
+            if intervals_overlap(working_intervals, order.delivery_intervals):
+                candidates.append(order)
+    return candidates
+
+
+def dispatch_orders(courier_ids=None):
+    with transaction.atomic():
+        open_regions = CourierRegion.objects.filter(
+            courier=OuterRef('pk'), region__in=Order.objects.filter(courier=None).values('region')
+        )
+        couriers = Courier.objects.filter(
+            Exists(open_regions),
+            ~Exists(Order.objects.filter(courier=OuterRef('pk'), complete_time=None))
+        ).order_by('courier_id').select_for_update(skip_locked=True)
+        if courier_ids is not None:
+            couriers = couriers.filter(courier_id__in=courier_ids)
+        couriers = list(couriers)
+        regions = {i for courier in couriers for i in courier.regions or []}
+        if not regions:
+            return {}, None
+        with stage('candidates'):
+            orders = Order.objects.filter(
+                courier=None, region__in=regions, weight__lte=max(COURIERS_TYPE_AND_WEIGHT_MAPPING.values())
+            ).select_for_update(skip_locked=True)
+            index = build_region_index(orders)
+        assign_time = dt.now()
+        aware_assign_time = tz.make_aware(assign_time)
+        taken = set()
+        assignments = {}
+        assigned_orders = []
+        for courier in couriers:
+            capacity = COURIERS_TYPE_AND_WEIGHT_MAPPING[courier.courier_type]
+            chosen = pack_orders(find_candidates(courier, index, taken), capacity)
+            if not chosen:
+                continue
+            for order in chosen:
+                order.courier = courier
+                order.assign_time = aware_assign_time
+                taken.add(order.order_id)
+            assigned_orders.extend(chosen)
+            assignments[courier.courier_id] = [i.order_id for i in chosen]
+        with stage('write'):
+            Order.objects.bulk_update(assigned_orders, ['courier', 'assign_time'], batch_size=500)
+        transaction.on_commit(lambda: dispatch_index.discard([i.order_id for i in assigned_orders]))
+        invalidate_couriers(assignments)
+        return assignments, assign_time.isoformat('T') + 'Z'
@@ -0,0 +1,53 @@
+import random
+
+from orders.models import COURIERS_TYPE_AND_WEIGHT_MAPPING, Courier, Order
+
+
+def format_hours(start, end):
+    return '{:02d}:{:02d}-{:02d}:{:02d}'.format(start // 60, start % 60, end // 60, end % 60)
+
+
+def random_hours(rnd, count=1):
+    hours = []
+    for _ in range(count):
+        start = rnd.randrange(8 * 60, 20 * 60, 30)
+        hours.append(format_hours(start, start + rnd.choice([30, 60, 120])))
+    return hours
+
+
+def courier_data(courier_id, rnd, regions=10):
+    return {
+        'courier_id': courier_id,
+        'courier_type': rnd.choice(list(COURIERS_TYPE_AND_WEIGHT_MAPPING)),
+        'regions': rnd.sample(range(1, regions + 1), min(3, regions)),
+        'working_hours': random_hours(rnd, 2),
+    }
+
+
+def order_data(order_id, rnd, regions=10, max_weight=50):
+    return {
+        'order_id': order_id,
+        'weight': round(rnd.uniform(0.01, max_weight), 2),
+        'region': rnd.randint(1, regions),
+        'delivery_hours': random_hours(rnd),
+    }
+
+
+def create_couriers(count, first_id=1, seed=0, **fields):
+    rnd = random.Random(seed)
+    couriers = []
+    for courier_id in range(first_id, first_id + count):
+        data = courier_data(courier_id, rnd)
+        data.update(fields)
+        couriers.append(Courier(**data))
+    return Courier.objects.bulk_create(couriers, batch_size=1000)
+
+
+def create_orders(count, first_id=1, seed=0, **fields):
+    rnd = random.Random(seed)
+    orders = []
+    for order_id in range(first_id, first_id + count):
+        data = order_data(order_id, rnd)
+        data.update(fields)
+        orders.append(Order(**data))
+    return Order.objects.bulk_create(orders, batch_size=1000)
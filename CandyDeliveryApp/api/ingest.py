@@ -0,0 +1,62 @@
+import json
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+
+from .dispatch_index import dispatch_index
+from .renderers import orjson
+from .serializers import OrderSerializer
+
+loads = json.loads if orjson is None else orjson.loads
+
+
+def import_batch(items, line_numbers, created, errors):
+    serializer = OrderSerializer(data=items, many=True)
+    validated, item_errors = serializer.validate_items(items)
+    valid = [i for i in validated if i is not None]
+    if valid:
+        dispatch_index.add(serializer.create(valid))
+        created.extend(i['order_id'] for i in valid)
+    for number, item, error in zip(line_numbers, items, item_errors):
+        if error:
+            errors.append({'line': number, 'id': item.get('order_id') if isinstance(item, dict) else None})
+            errors[-1].update(error)
+
+
+def request_lines(request):
+    if request.stream is not None:
+        return request.stream
+    # Chunked uploads have no Content-Length, so DRF reports no stream and Django's WSGI request reads
+    # nothing; the body is still complete on ASGI and in wsgi.input when the server terminates it
+    http_request = request._request
+    if isinstance(http_request, ASGIRequest):
+        return http_request
+    if http_request.META.get('wsgi.input_terminated'):
+        return http_request.META['wsgi.input']
+    return None
+
+
+def ingest_orders(lines, batch_size=None):
+    batch_size = batch_size or settings.BULK_IMPORT_BATCH_SIZE
+    created = []
+    errors = []
+    items = []
+    line_numbers = []
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            items.append(loads(line))
+        except ValueError:
+            errors.append({'line': number, 'id': None, 'non_field_errors': ['Invalid JSON']})
+            continue
+        line_numbers.append(number)
+        if len(items) >= batch_size:
+            import_batch(items, line_numbers, created, errors)
+            items = []
+            line_numbers = []
+    if items:
+        import_batch(items, line_numbers, created, errors)
+    errors.sort(key=lambda i: i['line'])
+    return created, errors
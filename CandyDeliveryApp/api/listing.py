@@ -0,0 +1,114 @@
+import base64
+import binascii
+import json
+
+from django.db import models
+from django.db.models import BooleanField, F, Func, Q, Value
+from django.utils.dateparse import parse_datetime
+from orders.models import Order
+
+from .renderers import dumps
+
+ORDER_FIELDS = (
+    'order_id', 'weight', 'region', 'delivery_hours', 'courier_id', 'assign_time', 'complete_time'
+)
+
+STATUS_FILTERS = {
+    'unassigned': Q(courier=None),
+    'active': Q(courier__isnull=False, complete_time=None),
+    'completed': Q(complete_time__isnull=False),
+}
+
+# Keys are compared in this order; NULL sorts after every value
+ORDER_KEY = ('order_id',)
+COURIER_ORDER_KEY = ('complete_time', 'order_id')
+
+
+def encode_cursor(row, key):
+    values = [row[i].isoformat() if hasattr(row[i], 'isoformat') else row[i] for i in key]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, key):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        values = None
+    if not isinstance(values, list) or len(values) != len(key):
+        raise ValueError('Invalid cursor')
+    for i, name in enumerate(key):
+        field = Order._meta.get_field(name)
+        if values[i] is None and field.null:
+            continue
+        if isinstance(field, models.DateTimeField):
+            values[i] = parse_datetime(values[i]) if isinstance(values[i], str) else None
+        elif not isinstance(values[i], int) or isinstance(values[i], bool):
+            values[i] = None
+        if values[i] is None:
+            raise ValueError('Invalid cursor')
+    return values
+
+
+class RowAfter(Func):
+    output_field = BooleanField()
+
+    def __init__(self, columns, values):
+        super().__init__(*columns, *values)
+
+    def as_sql(self, compiler, connection):
+        sql, params = [], []
+        for expression in self.source_expressions:
+            expression_sql, expression_params = compiler.compile(expression)
+            sql.append(expression_sql)
+            params.extend(expression_params)
+        half = len(sql) // 2
+        return '(%s) > (%s)' % (', '.join(sql[:half]), ', '.join(sql[half:])), params
+
+
+def after(model, key, values):
+    if len(key) == 1:
+        return Q(**{key[0] + '__gt': values[0]})
+    # A row value comparison lets the database seek along the index instead of expanding into an OR chain
+    return RowAfter([F(i) for i in key], [Value(v, output_field=model._meta.get_field(i)) for i, v in zip(key, values)])
+
+
+def key_ranges(queryset, key, cursor=None):
+    model = queryset.model
+    if not model._meta.get_field(key[0]).null:
+        ranges = [(queryset, key, cursor)]
+    else:
+        # NULLs of the leading key are read as a second range so that each one is a plain index scan
+        ranges = [
+            (queryset.filter(**{key[0] + '__isnull': False}), key, cursor),
+            (queryset.filter(**{key[0]: None}), key[1:], None),
+        ]
+        if cursor is not None and cursor[0] is None:
+            ranges = [(ranges[1][0], key[1:], cursor[1:])]
+    for part, part_key, part_cursor in ranges:
+        if part_cursor is not None:
+            part = part.filter(after(model, part_key, part_cursor))
+        yield part.order_by(*part_key).values(*ORDER_FIELDS)
+
+
+def filter_orders(queryset, region=None, status=None):
+    if region is not None:
+        queryset = queryset.filter(region=region)
+    if status is not None:
+        queryset = queryset.filter(STATUS_FILTERS[status])
+    return queryset
+
+
+def get_page(queryset, key, limit, cursor=None):
+    rows = []
+    for part in key_ranges(queryset, key, cursor):
+        rows.extend(part[:limit + 1 - len(rows)])
+        if len(rows) > limit:
+            break
+    next_cursor = encode_cursor(rows[limit - 1], key) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def stream_ndjson(queryset, key, cursor=None, chunk_size=2000):
+    for part in key_ranges(queryset, key, cursor):
+        for row in part.iterator(chunk_size=chunk_size):
+            yield dumps(row) + b'\n'
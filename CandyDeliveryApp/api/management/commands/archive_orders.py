@@ -0,0 +1,22 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone as tz
+
+from ...service import archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Moves completed orders older than the retention window to the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ORDER_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        before = tz.now() - datetime.timedelta(days=options['days'])
+        archived = archive_orders(before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Archived {} orders completed before {}'.format(
+            archived, before.isoformat()
+        )))
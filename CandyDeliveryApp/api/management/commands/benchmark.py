@@ -0,0 +1,26 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from ...benchmarks import SUITES
+
+
+class Command(BaseCommand):
+    help = 'Runs performance benchmarks and prints the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', choices=sorted(SUITES))
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000])
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--output')
+
+    def handle(self, *args, **options):
+        results = []
+        for name in options['suites'] or SUITES:
+            results.extend(SUITES[name](sizes=options['sizes'], repeat=options['repeat']))
+        data = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ...dispatcher import dispatch_orders
+
+
+class Command(BaseCommand):
+    help = 'Assigns the open order backlog across all available couriers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courier', type=int, nargs='+', dest='courier_ids')
+
+    def handle(self, *args, **options):
+        assignments, assign_time = dispatch_orders(options['courier_ids'])
+        for courier_id, order_ids in assignments.items():
+            self.stdout.write('Courier {}: {} orders'.format(courier_id, len(order_ids)))
+        self.stdout.write(self.style.SUCCESS('Assigned {} orders to {} couriers'.format(
+            sum(len(i) for i in assignments.values()), len(assignments)
+        )))
@@ -0,0 +1,118 @@
+import asyncio
+import functools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from orders.models import Courier
+
+from ...benchmarks import latency_summary
+
+FIRST_COURIER_ID = 10 ** 9
+
+
+def summarize(mode, latencies, elapsed, errors):
+    return dict({'mode': mode, 'errors': errors}, **latency_summary(latencies, elapsed))
+
+
+def run_wsgi(paths, concurrency):
+    client = Client()
+
+    def get(path):
+        started = time.perf_counter()
+        status = client.get(path).status_code
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(get, paths))
+    return results, time.perf_counter() - started
+
+
+def run_asgi(paths, concurrency):
+    async def run():
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def get(path):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path)
+                return time.perf_counter() - started, response.status_code
+
+        return await asyncio.gather(*(get(i) for i in paths))
+
+    started = time.perf_counter()
+    with override_settings(ROOT_URLCONF='api.async_urls'):
+        results = asyncio.run(run())
+    return results, time.perf_counter() - started
+
+
+def run_http(paths, concurrency, url):
+    def get(path):
+        started = time.perf_counter()
+        try:
+            with urlopen(url.rstrip('/') + path, timeout=30) as response:
+                response.read()
+                status = response.status
+        except HTTPError as error:
+            status = error.code
+        except OSError:
+            status = None
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(get, paths))
+    return results, time.perf_counter() - started
+
+
+MODES = {
+    'wsgi': run_wsgi,
+    'asgi': run_asgi,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Polls the courier endpoint with the sync and async views and prints req/s and latencies as JSON. '
+        'With --url it polls a running deployment instead, e.g. gunicorn CandyDeliveryApp.wsgi '
+        'or uvicorn CandyDeliveryApp.asgi:application, which must use the same database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('modes', nargs='*', help='One of: %s' % ', '.join(sorted(MODES)))
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--couriers', type=int, default=100)
+        parser.add_argument('--url', help='Base URL of a running server, e.g. http://127.0.0.1:8080')
+
+    def handle(self, *args, **options):
+        unknown = set(options['modes']) - set(MODES)
+        if unknown:
+            raise CommandError('Unknown mode: %s' % ', '.join(sorted(unknown)))
+        if options['url'] and options['modes']:
+            raise CommandError('Modes compare the in-process clients and can\'t be combined with --url')
+        courier_ids = range(FIRST_COURIER_ID, FIRST_COURIER_ID + options['couriers'])
+        Courier.objects.bulk_create([
+            Courier(courier_id=i, courier_type='bike', regions=[1, 2], working_hours=['09:00-18:00'])
+            for i in courier_ids
+        ])
+        paths = ['/couriers/%d/' % courier_ids[i % len(courier_ids)] for i in range(options['requests'])]
+        results = []
+        try:
+            if options['url']:
+                runs = {options['url']: functools.partial(run_http, url=options['url'])}
+            else:
+                runs = {i: MODES[i] for i in options['modes'] or MODES}
+            for mode, run in runs.items():
+                responses, elapsed = run(paths, options['concurrency'])
+                errors = sum(1 for _, status in responses if status != 200)
+                results.append(summarize(mode, [i for i, _ in responses], elapsed, errors))
+        finally:
+            Courier.objects.filter(courier_id__in=courier_ids).delete()
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,197 @@
+import asyncio
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+from .cache import get_stats
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+METRICS = {
+    'api_request_duration_seconds': ('histogram', 'Request latency by endpoint'),
+    'api_requests_total': ('counter', 'Requests by endpoint and status code'),
+    'api_db_queries_total': ('counter', 'Database queries by endpoint'),
+    'api_db_query_duration_seconds_total': ('counter', 'Time spent in database queries by endpoint'),
+    'api_stage_duration_seconds': ('histogram', 'Duration of named stages by endpoint'),
+}
+
+current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, labels, value):
+        key = name, labels
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def inc(self, name, labels, value=1):
+        key = name, labels
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def clear(self):
+        with self.lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def render(self):
+        with self.lock:
+            histograms = {key: (list(i.counts), i.sum) for key, i in self.histograms.items()}
+            counters = dict(self.counters)
+        lines = []
+        for name, (kind, description) in METRICS.items():
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for (key, labels), value in sorted(counters.items()):
+                if key == name:
+                    lines.append('%s%s %s' % (name, format_labels(labels), value))
+            for (key, labels), (counts, total) in sorted(histograms.items()):
+                if key != name:
+                    continue
+                cumulative = 0
+                for le, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append('%s_bucket%s %s' % (name, format_labels(labels + (('le', le),)), cumulative))
+                lines.append('%s_sum%s %s' % (name, format_labels(labels), total))
+                lines.append('%s_count%s %s' % (name, format_labels(labels), cumulative))
+        for name, value in get_stats().items():
+            if name != 'hit_ratio':
+                lines.append('# HELP api_courier_cache_%s_total Courier profile cache %s' % (name, name))
+                lines.append('# TYPE api_courier_cache_%s_total counter' % name)
+                lines.append('api_courier_cache_%s_total %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def format_labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % i for i in labels) if labels else ''
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'query_seconds', 'stages')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0
+        self.stages = {}
+
+
+@contextmanager
+def stage(name):
+    metrics = current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.stages[name] = metrics.stages.get(name, 0) + time.perf_counter() - start
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.query_seconds += time.perf_counter() - start
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Lets the handler see the instance as a coroutine function and keep the chain async
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        install_query_recorder(connection)
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.record(request, response, metrics, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        # Queries run in worker threads whose connections get the recorder through connection_created
+        metrics = RequestMetrics()
+        token = current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+        return self.record(request, response, metrics, time.perf_counter() - start)
+
+    def record(self, request, response, metrics, duration):
+        match = request.resolver_match
+        endpoint = match.url_name if match is not None and match.url_name else 'unmatched'
+        if endpoint == 'metrics':
+            return response
+        labels = ('endpoint', endpoint), ('method', request.method)
+        registry.observe('api_request_duration_seconds', labels, duration)
+        registry.inc('api_requests_total', labels + (('status', response.status_code),))
+        registry.inc('api_db_queries_total', labels, metrics.queries)
+        registry.inc('api_db_query_duration_seconds_total', labels, metrics.query_seconds)
+        for name, value in metrics.stages.items():
+            registry.observe('api_stage_duration_seconds', labels + (('stage', name),), value)
+        if settings.METRICS_SERVER_TIMING:
+            timings = [('db', metrics.query_seconds)] + list(metrics.stages.items()) + [('total', duration)]
+            response['Server-Timing'] = ', '.join('%s;dur=%.2f' % (name, value * 1000) for name, value in timings)
+        return response
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
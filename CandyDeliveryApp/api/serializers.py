@@ -1,113 +1,140 @@
 from datetime import datetime as dt
 
-from orders.models import Courier, Order
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone as tz
+from orders.models import ArchivedOrder, Courier, Order
 from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
 from rest_framework.fields import empty
 from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueValidator
 
+from .listing import STATUS_FILTERS, decode_cursor
+from .validators import validate_positive_integers, validate_time_ranges
 
-class CourierSerializer(serializers.ModelSerializer):
-    class Meta:
-        fields = ('courier_id', 'courier_type', 'regions', 'working_hours',)
-        model = Courier
 
-    def validate_regions(self, value):
-        for i in value:
-            if type(i) != type(1) or i <= 0:
-                raise serializers.ValidationError('The array must be composed of positive integers')
-        return value
+FIELD_NAMES = {}
 
-    def validate_working_hours(self, value):
-        for i in value:
-            if not isinstance(i, str):
-                raise serializers.ValidationError('The array must be composed of strings')
-            try:
-                dt.strptime(i[:5:], '%H:%M')
-                dt.strptime(i[6::], '%H:%M')
 
-            except ValueError:
-                raise serializers.ValidationError('The format of the array elements is incorrect')
-        return value
+class UnknownFieldsMixin:
+    def get_field_name_set(self):
+        field_names = FIELD_NAMES.get(type(self))
+        if field_names is None:
+            field_names = FIELD_NAMES[type(self)] = frozenset(self.fields)
+        return field_names
 
     def run_validation(self, data=empty):
-        if data is not empty:
-            unknown = set(data) - set(self.fields)
+        if isinstance(data, dict):
+            unknown = data.keys() - self.get_field_name_set()
             if unknown:
                 errors = ["Unknown field: {}".format(f) for f in unknown]
                 raise serializers.ValidationError({
                     api_settings.NON_FIELD_ERRORS_KEY: errors,
                 })
-        return super(CourierSerializer, self).run_validation(data)
+        return super().run_validation(data)
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model = self.child.Meta.model
+        self.pk_name = self.model._meta.pk.name
+        pk_field = self.child.fields[self.pk_name]
+        unique_validators = [i for i in pk_field.validators if isinstance(i, UniqueValidator)]
+        pk_field.validators = [i for i in pk_field.validators if not isinstance(i, UniqueValidator)]
+        self.unique_message = unique_validators[0].message if unique_validators else 'This field must be unique.'
+        self.unique_models = [self.model] + list(getattr(self.child.Meta, 'unique_across', ()))
+
+    def check_unique(self, validated, errors):
+        ids = [i[self.pk_name] for i in validated if i is not None]
+        existing = set()
+        for model in self.unique_models:
+            for start in range(0, len(ids), 500):
+                existing.update(model.objects.filter(pk__in=ids[start:start + 500]).values_list('pk', flat=True))
+        seen = set()
+        for i, item in enumerate(validated):
+            if item is None:
+                continue
+            pk = item[self.pk_name]
+            if pk in existing or pk in seen:
+                validated[i] = None
+                errors[i] = {self.pk_name: [ErrorDetail(self.unique_message, code='unique')]}
+            seen.add(pk)
+
+    def validate_items(self, data):
+        validated = []
+        errors = []
+        for item in data:
+            try:
+                validated.append(self.child.run_validation(item))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                validated.append(None)
+                errors.append(exc.detail)
+        self.check_unique(validated, errors)
+        return validated, errors
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            message = self.error_messages['not_a_list'].format(input_type=type(data).__name__)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='not_a_list')
+        if not self.allow_empty and not data:
+            message = self.error_messages['empty']
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='empty')
+        validated, errors = self.validate_items(data)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated
+
+    def create(self, validated_data):
+        instances = [self.model(**attrs) for attrs in validated_data]
+        with transaction.atomic():
+            return self.model.objects.bulk_create(instances, batch_size=settings.BULK_IMPORT_BATCH_SIZE)
+
+
+class CourierSerializer(UnknownFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        fields = ('courier_id', 'courier_type', 'regions', 'working_hours',)
+        model = Courier
+        list_serializer_class = BulkCreateListSerializer
+
+    def validate_regions(self, value):
+        return validate_positive_integers(value)
+
+    def validate_working_hours(self, value):
+        return validate_time_ranges(value)
 
 
-class CourierWithoutIdSerializer(serializers.ModelSerializer):
+class CourierWithoutIdSerializer(UnknownFieldsMixin, serializers.ModelSerializer):
     class Meta:
         fields = ('courier_type', 'working_hours', 'regions',)
         model = Courier
 
     def validate_regions(self, value):
-        for i in value:
-            if type(i) != type(1) or i <= 0:
-                raise serializers.ValidationError('The array must be composed of positive integers')
-        return value
+        return validate_positive_integers(value)
 
     def validate_working_hours(self, value):
-        for i in value:
-            if not isinstance(i, str):
-                raise serializers.ValidationError('The array must be composed of strings')
-            try:
-                dt.strptime(i[:5:], '%H:%M')
-                dt.strptime(i[6::], '%H:%M')
-
-            except ValueError:
-                raise serializers.ValidationError('The format of the array elements is incorrect')
-        return value
-
-    def run_validation(self, data=empty):
-        if data is not empty:
-            unknown = set(data) - set(self.fields)
-            if unknown:
-                errors = ["Unknown field: {}".format(f) for f in unknown]
-                raise serializers.ValidationError({
-                    api_settings.NON_FIELD_ERRORS_KEY: errors,
-                })
-        return super(CourierWithoutIdSerializer, self).run_validation(data)
+        return validate_time_ranges(value)
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(UnknownFieldsMixin, serializers.ModelSerializer):
     class Meta:
         fields = ('order_id', 'weight', 'region', 'delivery_hours')
         model = Order
+        list_serializer_class = BulkCreateListSerializer
+        unique_across = (ArchivedOrder,)
 
     def validate_delivery_hours(self, value):
-        for i in value:
-            if not isinstance(i, str):
-                raise serializers.ValidationError('The array must be composed of strings')
-            try:
-                dt.strptime(i[:5:], '%H:%M')
-                dt.strptime(i[6::], '%H:%M')
-
-            except ValueError:
-                raise serializers.ValidationError('The format of the array elements is incorrect')
-        return value
+        return validate_time_ranges(value)
 
     def validate_weight(self, value):
         if value <= 0:
             raise serializers.ValidationError('This field must be positive')
         return value
 
-    def run_validation(self, data=empty):
-        if data is not empty:
-            unknown = set(data) - set(self.fields)
-            if unknown:
-                errors = ["Unknown field: {}".format(f) for f in unknown]
-                raise serializers.ValidationError({
-                    api_settings.NON_FIELD_ERRORS_KEY: errors,
-                })
-        return super(OrderSerializer, self).run_validation(data)
-
 
-class OrderAssignmentSerializer(serializers.Serializer):
+class OrderAssignmentSerializer(UnknownFieldsMixin, serializers.Serializer):
     courier_id = serializers.IntegerField()
 
     def validate_courier_id(self, value):
@@ -117,18 +144,27 @@ class OrderAssignmentSerializer(serializers.Serializer):
             return value
         raise serializers.ValidationError('Courier with such id does not exist')
 
-    def run_validation(self, data=empty):
-        if data is not empty:
-            unknown = set(data) - set(self.fields)
-            if unknown:
-                errors = ["Unknown field: {}".format(f) for f in unknown]
-                raise serializers.ValidationError({
-                    api_settings.NON_FIELD_ERRORS_KEY: errors,
-                })
-        return super(OrderAssignmentSerializer, self).run_validation(data)
+
+class OrderDispatchSerializer(UnknownFieldsMixin, serializers.Serializer):
+    courier_ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+
+
+class OrderListSerializer(UnknownFieldsMixin, serializers.Serializer):
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=settings.ORDER_LIST_MAX_PAGE_SIZE, required=False)
+    region = serializers.IntegerField(min_value=1, required=False)
+    status = serializers.ChoiceField(choices=sorted(STATUS_FILTERS), required=False)
+    export = serializers.BooleanField(required=False)
+    archived = serializers.BooleanField(required=False)
+
+    def validate_cursor(self, value):
+        try:
+            return decode_cursor(value, self.context['key'])
+        except ValueError:
+            raise serializers.ValidationError('Invalid cursor')
 
 
-class OrderCompletionSerializer(serializers.Serializer):
+class OrderCompletionSerializer(UnknownFieldsMixin, serializers.Serializer):
     courier_id = serializers.IntegerField()
     order_id = serializers.IntegerField()
     complete_time = serializers.CharField()
@@ -136,35 +172,54 @@ class OrderCompletionSerializer(serializers.Serializer):
     def validate_courier_id(self, value):
         if value <= 0:
             raise serializers.ValidationError('This field must be positive')
-        if Courier.objects.filter(courier_id=value).exists():
-            return value
-        raise serializers.ValidationError('Courier with such id does not exist')
+        self.lookup['courier_id'] = value
+        return value
 
     def validate_order_id(self, value):
-        if Order.objects.filter(order_id=value).exists():
-            return value
-        raise serializers.ValidationError('Order with such id does not exist')
+        self.lookup['order_id'] = value
+        return value
 
     def validate_complete_time(self, value):
         try:
-            dt.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ')
+            return tz.make_aware(dt.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ'))
 
         except ValueError:
             raise serializers.ValidationError('The format is incorrect')
-        return value
+
+    def lookup_order(self):
+        courier_id = self.lookup.get('courier_id')
+        order_id = self.lookup.get('order_id')
+        self.order = None
+        if order_id is not None:
+            self.order = Order.objects.select_for_update(of=('self',)).select_related('courier').filter(
+                order_id=order_id
+            ).first()
+        errors = {}
+        if courier_id is not None and (self.order is None or self.order.courier_id != courier_id):
+            if not Courier.objects.filter(courier_id=courier_id).exists():
+                errors['courier_id'] = [ErrorDetail('Courier with such id does not exist', code='invalid')]
+        if order_id is not None and self.order is None:
+            errors['order_id'] = [ErrorDetail('Order with such id does not exist', code='invalid')]
+        return errors
+
+    def to_internal_value(self, data):
+        self.lookup = {}
+        try:
+            attrs = super().to_internal_value(data)
+            errors = {}
+        except serializers.ValidationError as exc:
+            attrs = None
+            errors = exc.detail
+        # Field errors are reported together with missing couriers and orders, a body that isn't an object is not
+        if api_settings.NON_FIELD_ERRORS_KEY not in errors:
+            errors.update(self.lookup_order())
+        if errors:
+            keys = [api_settings.NON_FIELD_ERRORS_KEY] + list(self.fields)
+            raise serializers.ValidationError({i: errors[i] for i in keys if i in errors})
+        attrs['order'] = self.order
+        return attrs
 
     def validate(self, data):
-        courier = Courier.objects.get(courier_id=data.get('courier_id'))
-        if not Order.objects.filter(order_id=data.get('order_id'), courier=courier).exists():
+        if data['order'].courier_id != data['courier_id']:
             raise serializers.ValidationError('The order was assigned to another courier or not assigned at all')
         return data
-
-    def run_validation(self, data=empty):
-        if data is not empty:
-            unknown = set(data) - set(self.fields)
-            if unknown:
-                errors = ["Unknown field: {}".format(f) for f in unknown]
-                raise serializers.ValidationError({
-                    api_settings.NON_FIELD_ERRORS_KEY: errors,
-                })
-        return super(OrderCompletionSerializer, self).run_validation(data)
@@ -1,47 +1,277 @@
-import datetime
-import json
+from collections import Counter
+from datetime import datetime as dt
 
-from orders.models import COURIERS_TYPE_AND_WEIGHT_MAPPING, Courier, Order
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import (BooleanField, Count, F, Func, OuterRef,
+                              Subquery, Sum)
+from django.db.models.functions import Coalesce
+from django.utils import timezone as tz
+from orders.intervals import intervals_overlap
+from orders.models import (COURIERS_TYPE_AND_WEIGHT_MAPPING, ArchivedOrder,
+                           Courier, CourierRegionStats, Order)
 
+from .assignment import pack_orders
+from .cache import invalidate_couriers
+from .dispatch_index import dispatch_index
+from .metrics import stage
 
-def check_overlap(t1_start, t1_end, t2_start, t2_end):
-    return t1_start < t2_end and t1_end > t2_start
 
+class SlotsOverlap(Func):
+    template = '(%(expressions)s) <> 0'
+    arg_joiner = ' | '
+    output_field = BooleanField()
 
-def dict_to_json(array):
-    r = json.dumps(array)
-    return json.loads(r)
 
+def get_candidate_orders(courier, assigned=None):
+    masks = [
+        F('delivery_slots_%d' % i).bitand(mask) for i, mask in enumerate(courier.working_slots) if mask
+    ]
+    if not masks:
+        return Order.objects.none()
+    # The slot masks only narrow the backlog down, exact overlap is still checked on the intervals
+    return Order.objects.filter(
+        SlotsOverlap(*masks),
+        courier=assigned,
+        region__in=courier.regions or [],
+        weight__lte=COURIERS_TYPE_AND_WEIGHT_MAPPING[courier.courier_type]
+    )
 
-def check_courier_and_order_overlap(working_hours, delivery_hours):
-    delivery_hours_dt = []
-    for i in delivery_hours:
-        delivery = i.split('-')
-        delivery1 = datetime.datetime.strptime(delivery[0], '%H:%M')
-        delivery2 = datetime.datetime.strptime(delivery[1], '%H:%M')
-        delivery_hours_dt.append((delivery1, delivery2))
-    for i in working_hours:
-        work = i.split('-')
-        work1 = datetime.datetime.strptime(work[0], '%H:%M')
-        work2 = datetime.datetime.strptime(work[1], '%H:%M')
-        for j in delivery_hours_dt:
-            flag = check_overlap(work1, work2, j[0], j[1])
-            if flag:
-                return flag
-    return False
 
+def get_active_orders(courier_id):
+    return Order.objects.filter(courier=courier_id, complete_time=None)
 
-def check_courier_and_orders_compatibility(courier_id, assigned=None):
-    orders = Order.objects.filter(courier=assigned)
+
+def get_completed_orders(courier_id, regions):
+    return Order.objects.filter(courier=courier_id, region__in=regions, complete_time__isnull=False)
+
+
+def check_courier_and_orders_compatibility(courier, assigned=None):
     suitable_orders = []
-    for order in orders:
-        courier = Courier.objects.get(courier_id=courier_id)
-        courier_weight = COURIERS_TYPE_AND_WEIGHT_MAPPING[courier.courier_type]
-        if order.weight > courier_weight:
-            continue
-        if order.region not in courier.regions:
-            continue
-        if not check_courier_and_order_overlap(courier.working_hours, order.delivery_hours):
-            continue
-        suitable_orders.append(order)
+    for order in get_candidate_orders(courier, assigned):
+        if intervals_overlap(courier.working_intervals, order.delivery_intervals):
+            suitable_orders.append(order)
     return suitable_orders
+
+
+def lock_orders(courier, order_ids):
+    orders = get_candidate_orders(courier).filter(order_id__in=order_ids).select_for_update(skip_locked=True)
+    return set(orders.values_list('order_id', flat=True))
+
+
+def lock_and_pack(courier, candidates):
+    capacity = COURIERS_TYPE_AND_WEIGHT_MAPPING[courier.courier_type]
+    chosen = []
+    for _ in range(settings.ASSIGNMENT_LOCK_ATTEMPTS):
+        packed = pack_orders(candidates, capacity)
+        if not packed:
+            break
+        locked = lock_orders(courier, [i.order_id for i in packed])
+        chosen.extend(i.order_id for i in packed if i.order_id in locked)
+        if len(locked) == len(packed):
+            break
+        capacity -= sum(i.weight for i in packed if i.order_id in locked)
+        packed_ids = {i.order_id for i in packed}
+        candidates = [i for i in candidates if i.order_id not in packed_ids]
+    return sorted(chosen)
+
+
+def assign_orders(courier_id):
+    with transaction.atomic():
+        courier = Courier.objects.select_for_update().get(courier_id=courier_id)
+        assigned_orders = list(get_active_orders(courier.courier_id).order_by('order_id'))
+        if assigned_orders:
+            date_str = assigned_orders[0].assign_time.isoformat('T') + 'Z'
+            return [i.order_id for i in assigned_orders], date_str
+        with stage('candidates'):
+            # The index may be stale, lock_orders re-checks the packed orders in the database. Orders imported by
+            # other processes only reach it on rebuild, so a result that can't fill the courier is read from SQL
+            capacity = COURIERS_TYPE_AND_WEIGHT_MAPPING[courier.courier_type]
+            candidates = dispatch_index.candidates(courier)
+            if candidates is None or sum(i.weight for i in candidates) < capacity:
+                candidates = check_courier_and_orders_compatibility(courier)
+        with stage('packing'):
+            order_ids = lock_and_pack(courier, candidates)
+        assign_time = dt.now()
+        if order_ids:
+            with stage('write'):
+                Order.objects.filter(order_id__in=order_ids).update(
+                    courier=courier, assign_time=tz.make_aware(assign_time)
+                )
+            transaction.on_commit(lambda: dispatch_index.discard(order_ids))
+            invalidate_couriers([courier.courier_id])
+        return order_ids, assign_time.isoformat('T') + 'Z'
+
+
+REASSIGNMENT_FIELDS = ('courier_type', 'regions', 'working_hours')
+
+
+def release_incompatible_orders(courier, previous):
+    changed = {i for i in REASSIGNMENT_FIELDS if previous[i] != getattr(courier, i)}
+    if not changed:
+        return []
+    orders = get_active_orders(courier.courier_id).only(
+        'order_id', 'weight', 'region', 'delivery_intervals'
+    )
+    capacity = COURIERS_TYPE_AND_WEIGHT_MAPPING[courier.courier_type]
+    regions = set(courier.regions or [])
+    kept = []
+    released = []
+    for order in orders:
+        if 'regions' in changed and order.region not in regions:
+            released.append(order)
+        elif 'courier_type' in changed and order.weight > capacity:
+            released.append(order)
+        elif 'working_hours' in changed and not intervals_overlap(courier.working_intervals, order.delivery_intervals):
+            released.append(order)
+        else:
+            kept.append(order)
+    if 'courier_type' in changed and kept:
+        packed = {i.order_id for i in pack_orders(kept, capacity)}
+        released.extend(i for i in kept if i.order_id not in packed)
+    if released:
+        Order.objects.filter(order_id__in=[i.order_id for i in released]).update(courier=None, assign_time=None)
+        transaction.on_commit(lambda: dispatch_index.add(released))
+    return released
+
+
+def complete_order(order, complete_time):
+    previous_complete_time = order.complete_time
+    order.completed = True
+    order.complete_time = complete_time
+    with stage('write'):
+        Order.objects.filter(order_id=order.order_id, courier=order.courier_id).update(
+            completed=True, complete_time=complete_time
+        )
+    with stage('stats'):
+        record_completion(order, previous_complete_time)
+    transaction.on_commit(lambda: dispatch_index.discard([order.order_id]))
+    invalidate_couriers([order.courier_id])
+    return order
+
+
+def rebuild_region_stats(courier_id, region):
+    times = list(get_completed_orders(courier_id, [region]).values_list('assign_time', 'complete_time'))
+    times.extend(ArchivedOrder.objects.filter(
+        courier=courier_id, region=region
+    ).values_list('assign_time', 'complete_time'))
+    times.sort(key=lambda i: i[1])
+    stats = CourierRegionStats(courier_id=courier_id, region=region)
+    for assign_time, complete_time in times:
+        start = assign_time if stats.last_complete_time is None else stats.last_complete_time
+        stats.completed_count += 1
+        stats.delivery_seconds += (complete_time - start).total_seconds()
+        stats.last_complete_time = complete_time
+    stats, _ = CourierRegionStats.objects.update_or_create(courier_id=courier_id, region=region, defaults={
+        'completed_count': stats.completed_count,
+        'delivery_seconds': stats.delivery_seconds,
+        'last_complete_time': stats.last_complete_time,
+    })
+    return stats
+
+
+def record_completion(order, previous_complete_time=None):
+    stats, _ = CourierRegionStats.objects.select_for_update().get_or_create(
+        courier_id=order.courier_id, region=order.region
+    )
+    last_complete_time = stats.last_complete_time
+    if previous_complete_time is not None or (last_complete_time and order.complete_time < last_complete_time):
+        rebuild_region_stats(order.courier_id, order.region)
+        return
+    start = order.assign_time if last_complete_time is None else last_complete_time
+    stats.completed_count += 1
+    stats.delivery_seconds += (order.complete_time - start).total_seconds()
+    stats.last_complete_time = order.complete_time
+    stats.save()
+
+
+def duration_seconds_sql(end, start):
+    sql, _ = connection.ops.subtract_temporals('DateTimeField', (end, []), (start, []))
+    if connection.vendor == 'postgresql':
+        return 'EXTRACT(EPOCH FROM %s)' % sql
+    return '(%s) / 1000000.0' % sql
+
+
+def rating_from_time(min_time):
+    return None if min_time is None else round((60*60 - min(min_time, 60*60))/(60*60) * 5, 2)
+
+
+def calculate_rating(courier):
+    min_time = None
+    for stats in courier.region_stats.filter(region__in=courier.regions or [], completed_count__gt=0):
+        avg_time = stats.delivery_seconds / stats.completed_count
+        min_time = avg_time if min_time is None else min(avg_time, min_time)
+    return rating_from_time(min_time)
+
+
+def calculate_rating_sql(courier):
+    if not courier.regions:
+        return None
+    # Archived orders are part of the history, the first live order in a region follows the last archived one
+    fields = ('region', 'assign_time', 'complete_time')
+    live = get_completed_orders(courier.courier_id, courier.regions).values_list(*fields)
+    archived = ArchivedOrder.objects.filter(courier=courier.courier_id, region__in=courier.regions).values_list(*fields)
+    sql, params = live.union(archived, all=True).query.sql_with_params()
+    previous = 'COALESCE(LAG(complete_time) OVER (PARTITION BY region ORDER BY complete_time), assign_time)'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT MIN(avg_seconds) FROM (SELECT AVG(seconds) AS avg_seconds FROM '
+            '(SELECT region, {} AS seconds FROM ({}) orders) durations GROUP BY region) regions'.format(
+                duration_seconds_sql('complete_time', previous), sql
+            ),
+            params
+        )
+        min_time = cursor.fetchone()[0]
+    return rating_from_time(None if min_time is None else float(min_time))
+
+
+def count_assigned_orders(courier):
+    live = Order.objects.filter(courier=OuterRef('pk')).exclude(assign_time=None).values('courier').annotate(
+        total=Count('pk')
+    ).values('total')
+    archived = CourierRegionStats.objects.filter(courier=OuterRef('pk')).values('courier').annotate(
+        total=Sum('archived_count')
+    ).values('total')
+    counts = Courier.objects.filter(pk=courier.pk).annotate(
+        live=Coalesce(Subquery(live), 0), archived=Coalesce(Subquery(archived), 0)
+    ).values_list('live', 'archived').get()
+    return sum(counts)
+
+
+def archive_orders(before, batch_size=None):
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    archived = 0
+    while True:
+        with transaction.atomic():
+            orders = list(Order.objects.filter(complete_time__lt=before).order_by('order_id').select_for_update(
+                skip_locked=True
+            )[:batch_size])
+            if not orders:
+                return archived
+            ArchivedOrder.objects.bulk_create([ArchivedOrder(
+                order_id=i.order_id, weight=i.weight, region=i.region, delivery_hours=i.delivery_hours,
+                courier_id=i.courier_id, completed=i.completed, assign_time=i.assign_time,
+                complete_time=i.complete_time
+            ) for i in orders])
+            counts = Counter((i.courier_id, i.region) for i in orders if i.courier_id is not None)
+            stats = {
+                (i.courier_id, i.region): i
+                for i in CourierRegionStats.objects.select_for_update().filter(courier__in={i[0] for i in counts})
+            }
+            Order.objects.filter(order_id__in=[i.order_id for i in orders]).delete()
+            for key, count in counts.items():
+                if key not in stats:
+                    stats[key] = rebuild_region_stats(*key)
+                stats[key].archived_count += count
+            CourierRegionStats.objects.bulk_update([stats[i] for i in counts], ['archived_count'], batch_size=500)
+            archived += len(orders)
+
+
+RATING_CALCULATORS = {
+    'stats': calculate_rating,
+    'sql': calculate_rating_sql,
+}
+
+
+def get_courier_rating(courier):
+    return RATING_CALCULATORS[settings.COURIER_RATING_SOURCE](courier)
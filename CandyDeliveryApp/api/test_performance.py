@@ -0,0 +1,115 @@
+import json
+import math
+import random
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from orders.models import Order
+
+from .benchmarks import benchmark_api, run_api_cases
+from .factories import courier_data, create_couriers, create_orders, order_data
+
+
+@override_settings(COURIER_CACHE_ENABLED=False, BULK_IMPORT_BATCH_SIZE=50)
+class TestQueryCounts(TestCase):
+    def count_queries(self, method, name, data=None, **kwargs):
+        url = reverse(name, kwargs=kwargs)
+        with CaptureQueriesContext(connection) as context:
+            if data is None:
+                response = getattr(self.client, method)(url)
+            else:
+                response = getattr(self.client, method)(url, data=json.dumps(data), content_type='application/json')
+        self.assertLess(response.status_code, 400, response.data)
+        return len(context.captured_queries)
+
+    def test_import_couriers(self):
+        rnd = random.Random(0)
+        for first_id, size in ((1, 10), (100, 500)):
+            data = [courier_data(i, rnd) for i in range(first_id, first_id + size)]
+            queries = self.count_queries('post', 'couriers', data)
+            # Uniqueness check and savepoints plus one insert per table and batch
+            self.assertLessEqual(queries, 5 + 3 * math.ceil(size / 50))
+
+    def test_import_orders(self):
+        rnd = random.Random(0)
+        for first_id, size in ((1, 10), (100, 500)):
+            data = [order_data(i, rnd) for i in range(first_id, first_id + size)]
+            queries = self.count_queries('post', 'orders', data)
+            self.assertLessEqual(queries, 5 + math.ceil(size / 50))
+
+    def test_assign_does_not_depend_on_backlog(self):
+        counts = []
+        first_id = 1
+        for courier_id, size in ((1, 10), (2, 1000)):
+            create_couriers(1, first_id=courier_id, courier_type='car', regions=[1, 2], working_hours=['08:00-22:00'])
+            create_orders(size, first_id=first_id, region=1)
+            first_id += size
+            counts.append(self.count_queries('post', 'orders_assign', {'courier_id': courier_id}))
+            self.assertTrue(Order.objects.filter(courier=courier_id).exists())
+        self.assertEqual(counts[0], counts[1])
+
+    def test_complete_does_not_depend_on_history(self):
+        counts = []
+        courier = create_couriers(1, courier_type='car', regions=[1], working_hours=['08:00-22:00'])[0]
+        for first_id, size in ((1, 10), (100, 1000)):
+            create_orders(size, first_id=first_id, region=1, weight=1, courier=courier)
+            Order.objects.filter(courier=courier).update(assign_time='2021-03-01T10:00:00Z')
+            for order_id in (first_id, first_id + 1):
+                queries = self.count_queries('post', 'orders_complete', {
+                    'courier_id': courier.courier_id, 'order_id': order_id, 'complete_time': '2021-03-01T10:30:00.00Z'
+                })
+            # The first completion in a region also creates its stats row
+            counts.append(queries)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_courier_detail_does_not_depend_on_history(self):
+        counts = []
+        courier = create_couriers(1, courier_type='car', regions=[1, 2, 3], working_hours=['08:00-22:00'])[0]
+        for first_id, size in ((1, 10), (100, 1000)):
+            create_orders(size, first_id=first_id, weight=1, courier=courier)
+            Order.objects.filter(courier=courier).update(
+                assign_time='2021-03-01T10:00:00Z', complete_time='2021-03-01T10:30:00Z', completed=True
+            )
+            counts.append(self.count_queries('get', 'couriers_detail', courier_id=courier.courier_id))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_patch_does_not_depend_on_active_orders(self):
+        counts = []
+        for courier_id, size in ((1, 10), (2, 1000)):
+            create_couriers(1, first_id=courier_id, courier_type='car', regions=[1, 2], working_hours=['08:00-22:00'])
+            create_orders(size, first_id=courier_id * 10000, region=1, weight=1, courier_id=courier_id)
+            counts.append(self.count_queries(
+                'patch', 'couriers_detail', {'regions': [2], 'courier_type': 'foot'}, courier_id=courier_id
+            ))
+            self.assertFalse(Order.objects.filter(courier=courier_id).exists())
+        self.assertEqual(counts[0], counts[1])
+
+    def test_dispatch_writes_in_batches(self):
+        for first_id, size in ((1, 10), (100, 400)):
+            create_couriers(size, first_id=first_id, regions=[1, 2], working_hours=['08:00-22:00'])
+            create_orders(size * 3, first_id=first_id * 10, region=1, weight=1)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(reverse('orders_dispatch'), data={}, content_type='application/json')
+            assigned = sum(len(i['orders']) for i in response.data['couriers'])
+            self.assertEqual(assigned, size * 3)
+            # Couriers and orders are read once, assignments are written in bulk_update batches
+            batch_size = min(500, connection.ops.bulk_batch_size(['pk', 'pk', 'courier', 'assign_time'], []))
+            self.assertLessEqual(len(context.captured_queries), 4 + math.ceil(assigned / batch_size))
+
+
+class TestBenchmarkHarness(TestCase):
+    def test_api_suite(self):
+        results = benchmark_api(sizes=[50], repeat=2, sample=5)
+        self.assertEqual(
+            [i['case'] for i in results], ['import_couriers', 'import_orders', 'assign', 'complete', 'courier_detail']
+        )
+        self.assertEqual(results[2]['requests'], 5)
+        for result in results:
+            self.assertLessEqual(result['seconds']['best'], result['seconds']['mean'])
+        with mock.patch('api.benchmarks.run_api_cases', wraps=run_api_cases) as run:
+            benchmark_api(sizes=[10, 20], repeat=3, sample=5)
+        self.assertEqual(run.call_count, 6)
+        self.assertFalse(Order.objects.exists())
@@ -1,15 +1,49 @@
+import asyncio
 import datetime
 import json
+import random
+import threading
+import time
 from datetime import datetime as dt
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-from django.test import Client, TestCase
+from asgiref.sync import async_to_sync
+from CandyDeliveryApp.db.pool import ConnectionPool, PoolTimeout
+from django.core.management import call_command
+from django.db import connection
+from django.test import (AsyncClient, Client, RequestFactory, SimpleTestCase,
+                         TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone as tz
-from orders.models import COURIER_EARNINGS_COEFFICIENTS, Courier, Order
+from orders.intervals import (compile_intervals, compile_slots,
+                              intervals_overlap)
+from orders.models import (COURIER_EARNINGS_COEFFICIENTS, ArchivedOrder,
+                           Courier, CourierRegion, Order)
+from rest_framework.exceptions import ErrorDetail, ValidationError
+from rest_framework.renderers import JSONRenderer
+
+from .assignment import STRATEGIES, pack_orders
+from .async_views import ASGIHandler, run_view
+from .cache import get_cache, get_stats
+from .dispatch_index import DispatchIndex
+from .listing import COURIER_ORDER_KEY, key_ranges, stream_ndjson
+from .metrics import registry
+from .parsers import FastJSONParser
+from .renderers import FastJSONRenderer
+from .serializers import FIELD_NAMES, CourierSerializer
+from .service import (archive_orders, calculate_rating, calculate_rating_sql,
+                      check_courier_and_orders_compatibility,
+                      get_active_orders, get_candidate_orders,
+                      get_completed_orders, rebuild_region_stats)
+from .validators import validate_positive_integers, validate_time_ranges
+from .views import api_orders_stream
 
 
 class TestCouriers(TestCase):
     def setUp(self):
+        get_cache().clear()
         self.client = Client()
         self.courier = Courier.objects.create(
             courier_id=1, courier_type='bike', regions=[1, 2, 3], working_hours=['11:00-12:00']
@@ -78,6 +112,35 @@ class TestCouriers(TestCase):
         self.assertEqual(Courier.objects.all().count(), self.orders_number)
         self.assertEqual(len(response.data['validation_error']['couriers']), 4)
 
+    def test_create_couriers_in_bulk(self):
+        data = [
+            {'courier_id': i, 'courier_type': 'foot', 'regions': [1], 'working_hours': ['09:00-18:00']}
+            for i in range(2, 52)
+        ]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('couriers'), data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['couriers']), 50)
+        self.assertEqual(Courier.objects.count(), 51)
+        self.assertEqual(Courier.objects.get(courier_id=50).working_intervals, [[540, 1080]])
+        inserts = [i['sql'].split()[2] for i in context.captured_queries if i['sql'].startswith('INSERT')]
+        self.assertEqual(sorted(inserts), ['"orders_courier"', '"orders_courierregion"', '"orders_couriershift"'])
+        self.assertEqual(CourierRegion.objects.filter(region=1).count(), 51)
+        self.assertLessEqual(len(context.captured_queries), 8)
+
+    def test_create_couriers_with_duplicate_ids(self):
+        data = [
+            {'courier_id': 1, 'courier_type': 'foot', 'regions': [1], 'working_hours': []},
+            {'courier_id': 7, 'courier_type': 'foot', 'regions': [1], 'working_hours': []},
+            {'courier_id': 7, 'courier_type': 'foot', 'regions': [1], 'working_hours': []},
+        ]
+        response = self.client.post(reverse('couriers'), data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['validation_error']['couriers']
+        self.assertEqual([i['id'] for i in errors], [1, 7])
+        self.assertEqual([i['courier_id'][0].code for i in errors], ['unique', 'unique'])
+        self.assertEqual(Courier.objects.count(), 1)
+
     def test_patch_couriers(self):
         data = {
             'regions': [2, 3]
@@ -98,6 +161,58 @@ class TestCouriers(TestCase):
         self.assertEqual(order.assign_time, None)
         self.assertEqual(order.courier, None)
 
+    def test_patch_courier_type_releases_orders_over_capacity(self):
+        Order.objects.filter(order_id=self.order.order_id).update(weight=6)
+        Order.objects.create(
+            order_id=2, weight=5, region=2, delivery_hours=['11:00-13:00'], courier=self.courier, assign_time=dt.now(tz=tz.utc)
+        )
+        Order.objects.create(
+            order_id=3, weight=9, region=3, delivery_hours=['11:00-13:00'], courier=self.courier,
+            assign_time=dt.now(tz=tz.utc), complete_time=dt.now(tz=tz.utc)
+        )
+        data = {'courier_type': 'foot'}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                reverse('couriers_detail', kwargs={'courier_id': 1}), data=json.dumps(data), content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len([i for i in context.captured_queries if i['sql'].startswith('UPDATE "orders_order"')]), 1)
+        self.assertEqual(sorted(self.courier.orders.values_list('order_id', flat=True)), [2, 3])
+
+    def test_patch_without_reassignment_fields(self):
+        data = {'courier_type': 'bike', 'regions': [1, 2, 3]}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.patch(
+                reverse('couriers_detail', kwargs={'courier_id': 1}), data=json.dumps(data), content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([i for i in context.captured_queries if '"orders_order"' in i['sql']])
+        self.assertEqual(Order.objects.get(order_id=self.order.order_id).courier, self.courier)
+
+    def test_patch_syncs_region_and_shift_tables(self):
+        data = {'regions': [2, 5, 5], 'working_hours': ['18:00-20:00', '08:00-10:00']}
+        response = self.client.patch(
+            reverse('couriers_detail', kwargs={'courier_id': 1}), data=json.dumps(data), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(self.courier.region_links.values_list('region', flat=True)), [2, 5])
+        self.assertEqual(list(self.courier.shifts.order_by('start').values_list('start', 'end')), [(480, 600), (1080, 1200)])
+
+    def test_patch_syncs_only_changed_schedule_tables(self):
+        url = reverse('couriers_detail', kwargs={'courier_id': 1})
+        for data, tables in (
+            ({'courier_type': 'car'}, set()),
+            ({'regions': [2, 5]}, {'"orders_courierregion"'}),
+            ({'working_hours': ['08:00-10:00']}, {'"orders_couriershift"'}),
+        ):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.patch(url, data=json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            writes = {i['sql'].split()[2] for i in context.captured_queries if i['sql'].startswith(('DELETE', 'INSERT'))}
+            self.assertEqual(writes, tables, data)
+        self.assertEqual(sorted(self.courier.region_links.values_list('region', flat=True)), [2, 5])
+        self.assertEqual(list(self.courier.shifts.values_list('start', 'end')), [(480, 600)])
+
     def test_patch_with_invalid_data(self):
         data = {'regions': [2, 3], 'extra': 1}
         response = self.client.patch(
@@ -108,10 +223,16 @@ class TestCouriers(TestCase):
         self.assertEqual(courier.regions, self.courier.regions)
 
     def test_get_courier_stats(self):
+        assign_time = dt.now(tz=tz.utc)
         Order.objects.create(
-            order_id=10, weight=14, region=1, delivery_hours=['11:00-13:00'],
-            courier=self.courier, assign_time=dt.now(tz=tz.utc), complete_time=dt.now(tz=tz.utc) + datetime.timedelta(minutes=10)
+            order_id=10, weight=14, region=1, delivery_hours=['11:00-13:00'], courier=self.courier, assign_time=assign_time
         )
+        data = {
+            'courier_id': self.courier.courier_id,
+            'order_id': 10,
+            'complete_time': (assign_time + datetime.timedelta(minutes=10)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        }
+        self.client.post(reverse('orders_complete'), data=json.dumps(data), content_type='application/json')
         response = self.client.get(reverse('couriers_detail', kwargs={'courier_id': self.courier.courier_id}))
         self.assertNotEqual(response.status_code, 404)
         stats = response.data
@@ -125,6 +246,30 @@ class TestCouriers(TestCase):
         earnings = (self.orders_number + 1) * 500 * COURIER_EARNINGS_COEFFICIENTS[self.courier.courier_type]
         self.assertEqual(stats.get('earnings'), earnings)
 
+    def test_region_stats_updated_incrementally(self):
+        start = dt(2021, 3, 1, 10, tzinfo=tz.utc)
+        Order.objects.filter(order_id=self.order.order_id).update(assign_time=start)
+        Order.objects.create(
+            order_id=2, weight=1, region=2, delivery_hours=['11:00-13:00'], courier=self.courier, assign_time=start
+        )
+        Order.objects.create(
+            order_id=3, weight=1, region=1, delivery_hours=['11:00-13:00'], courier=self.courier, assign_time=start
+        )
+        for order_id, minutes in ((1, 20), (2, 10), (3, 30), (1, 40)):
+            data = {
+                'courier_id': self.courier.courier_id,
+                'order_id': order_id,
+                'complete_time': (start + datetime.timedelta(minutes=minutes)).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            }
+            response = self.client.post(reverse('orders_complete'), data=json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        stats = {i.region: i for i in self.courier.region_stats.all()}
+        self.assertEqual((stats[1].completed_count, stats[1].delivery_seconds), (2, 40 * 60))
+        self.assertEqual((stats[2].completed_count, stats[2].delivery_seconds), (1, 10 * 60))
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('couriers_detail', kwargs={'courier_id': self.courier.courier_id}))
+        self.assertEqual(response.data['rating'], round((60*60 - 10*60)/(60*60) * 5, 2))
+
 
 class TestOrders(TestCase):
     def setUp(self):
@@ -136,10 +281,10 @@ class TestOrders(TestCase):
             courier_id=2, courier_type='bike', regions=[1, 2, 3], working_hours=['11:00-12:00']
         )
         self.order1 = Order.objects.create(
-            order_id=10, weight=14, region=1, delivery_hours=['11:00-13:00']
+            order_id=10, weight=7, region=1, delivery_hours=['11:00-13:00']
         )
         self.order2 = Order.objects.create(
-            order_id=11, weight=14, region=1, delivery_hours=['11:00-13:00']
+            order_id=11, weight=7, region=1, delivery_hours=['11:00-13:00']
         )
         Order.objects.create(
             order_id=20, weight=16, region=3, delivery_hours=['11:30-18:00']
@@ -232,6 +377,40 @@ class TestOrders(TestCase):
         self.assertEqual(Order.objects.all().count(), self.orders_number)
         self.assertEqual(len(response.data['validation_error']['orders']), 5)
 
+    def test_stream_orders(self):
+        lines = [
+            json.dumps({'order_id': i, 'weight': 1, 'region': 1, 'delivery_hours': ['09:00-18:00']})
+            for i in range(100, 105)
+        ]
+        lines[1] = json.dumps({'order_id': 10, 'weight': 1, 'region': 1, 'delivery_hours': ['09:00-18:00']})
+        lines[2] = '{"order_id": 102, '
+        lines[3] = json.dumps({'order_id': 103, 'weight': -1, 'region': 1, 'delivery_hours': ['09:00-18:00']})
+        lines.insert(1, '')
+        with self.settings(BULK_IMPORT_BATCH_SIZE=2):
+            response = self.client.post(
+                reverse('orders_stream'), data='\n'.join(lines), content_type='application/x-ndjson'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['orders'], [{'id': 100}, {'id': 104}])
+        errors = response.data['validation_error']['orders']
+        self.assertEqual([(i['line'], i['id']) for i in errors], [(3, 10), (4, None), (5, 103)])
+        self.assertEqual(Order.objects.get(order_id=104).delivery_intervals, [[540, 1080]])
+
+    def test_stream_orders_without_content_length(self):
+        body = '\n'.join(
+            json.dumps({'order_id': i, 'weight': 1, 'region': 1, 'delivery_hours': ['09:00-18:00']}) for i in (100, 101)
+        ).encode()
+        factory = RequestFactory()
+        request = factory.post(
+            reverse('orders_stream'), data=body, content_type='application/x-ndjson',
+            CONTENT_LENGTH='', **{'wsgi.input': BytesIO(body), 'wsgi.input_terminated': True}
+        )
+        response = api_orders_stream(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['orders'], [{'id': 100}, {'id': 101}])
+        request = factory.post(reverse('orders_stream'), data=body, content_type='application/x-ndjson', CONTENT_LENGTH='')
+        self.assertEqual(api_orders_stream(request).status_code, 411)
+
     def test_orders_assign(self):
         data = {'courier_id': self.courier.courier_id}
         response = self.client.post(reverse('orders_assign'), data=json.dumps(data), content_type='application/json')
@@ -243,6 +422,58 @@ class TestOrders(TestCase):
         response = self.client.post(reverse('orders_assign'), data=json.dumps(data), content_type='application/json')
         self.assertEqual(response.data, {'orders': [{'id': self.order2.order_id}], 'assign_time': assign_time})
 
+    def test_candidate_orders_filtered_in_database(self):
+        candidates = get_candidate_orders(self.courier)
+        self.assertEqual(sorted(candidates.values_list('order_id', flat=True)), [10, 11])
+        with self.assertNumQueries(1):
+            suitable_orders = check_courier_and_orders_compatibility(self.courier)
+        self.assertEqual(sorted(i.order_id for i in suitable_orders), [10, 11])
+
+    def test_candidate_slots_checked_exactly(self):
+        Order.objects.create(order_id=60, weight=1, region=9, delivery_hours=['12:03-12:10'])
+        courier = Courier.objects.create(
+            courier_id=3, courier_type='foot', regions=[9], working_hours=['12:00-12:02']
+        )
+        self.assertIn(60, get_candidate_orders(courier).values_list('order_id', flat=True))
+        self.assertEqual(check_courier_and_orders_compatibility(courier), [])
+
+    def test_orders_assign_writes_single_update(self):
+        data = {'courier_id': self.courier.courier_id}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('orders_assign'), data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        updates = [i['sql'] for i in context.captured_queries if i['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(Order.objects.filter(courier=self.courier).count(), 2)
+
+    def test_orders_assign_respects_capacity(self):
+        Order.objects.create(order_id=12, weight=9, region=2, delivery_hours=['11:00-13:00'])
+        data = {'courier_id': self.courier.courier_id}
+        response = self.client.post(reverse('orders_assign'), data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        assigned = Order.objects.filter(courier=self.courier)
+        self.assertEqual(len(response.data['orders']), assigned.count())
+        self.assertLessEqual(sum(i.weight for i in assigned), 15)
+
+    def test_orders_assign_locks_only_packed_orders(self):
+        Courier.objects.create(courier_id=3, courier_type='foot', regions=[9], working_hours=['11:00-13:00'])
+        for order_id, weight in [(61, 3), (62, 4), (63, 3), (64, 2)]:
+            Order.objects.create(order_id=order_id, weight=weight, region=9, delivery_hours=['11:00-12:00'])
+        calls = []
+
+        def lock_orders(courier, order_ids):
+            calls.append(sorted(order_ids))
+            # Order 64 is taken by a concurrent assignment
+            return set(order_ids) - {64}
+
+        with mock.patch('api.service.lock_orders', lock_orders), self.settings(ASSIGNMENT_STRATEGY='lightest_first'):
+            response = self.client.post(
+                reverse('orders_assign'), data=json.dumps({'courier_id': 3}), content_type='application/json'
+            )
+        self.assertEqual(response.data['orders'], [{'id': 61}, {'id': 62}, {'id': 63}])
+        self.assertEqual(calls, [[61, 63, 64], [62]])
+        self.assertEqual(Order.objects.get(order_id=64).courier, None)
+
     def test_orders_assign_with_invalid_data(self):
         data = {'courier_id': 3}
         response = self.client.post(reverse('orders_assign'), data=json.dumps(data), content_type='application/json')
@@ -251,6 +482,28 @@ class TestOrders(TestCase):
         response = self.client.post(reverse('orders_assign'), data=json.dumps(data), content_type='application/json')
         self.assertEqual(response.status_code, 400)
 
+    def test_orders_dispatch(self):
+        Courier.objects.create(courier_id=3, courier_type='car', regions=[1, 3], working_hours=['11:00-19:00'])
+        response = self.client.post(reverse('orders_dispatch'), data=json.dumps({}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['couriers'], [
+            {'id': 1, 'orders': [{'id': 10}, {'id': 11}]},
+            {'id': 3, 'orders': [{'id': 20}, {'id': 40}]},
+        ])
+        self.assertEqual(Order.objects.filter(courier=self.courier2).count(), 1)
+        self.assertEqual(list(Order.objects.filter(courier=None).values_list('order_id', flat=True)), [30])
+        response = self.client.post(reverse('orders_dispatch'), data=json.dumps({}), content_type='application/json')
+        self.assertEqual(response.data, {'couriers': []})
+
+    def test_orders_dispatch_command(self):
+        call_command('dispatch_orders', courier_ids=[1], stdout=StringIO())
+        self.assertEqual(list(Order.objects.filter(courier=self.courier).values_list('order_id', flat=True)), [10, 11])
+
+    def test_orders_dispatch_with_invalid_data(self):
+        for data in ({'courier_ids': [0]}, {'extra': 1}):
+            response = self.client.post(reverse('orders_dispatch'), data=json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
     def test_orders_complete(self):
         data = {
             'courier_id': self.courier2.courier_id,
@@ -262,6 +515,50 @@ class TestOrders(TestCase):
         self.assertEqual(response.data, {'order_id': self.order3.order_id})
         self.assertEqual(Order.objects.exclude(complete_time=None).count(), 1)
         
+    def test_orders_complete_queries(self):
+        data = {
+            'courier_id': self.courier2.courier_id,
+            'order_id': self.order3.order_id,
+            'complete_time': (dt.now() + datetime.timedelta(minutes=10)).isoformat('T') + 'Z'
+        }
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('orders_complete'), data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        queries = [i['sql'] for i in context.captured_queries if '"orders_order"' in i['sql']]
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(queries[0].startswith('SELECT') and queries[1].startswith('UPDATE'))
+
+    def test_orders_complete_errors(self):
+        cases = [
+            ({'courier_id': 5, 'order_id': 50}, {'courier_id': ['Courier with such id does not exist']}),
+            ({'courier_id': 5, 'order_id': 60}, {
+                'courier_id': ['Courier with such id does not exist'],
+                'order_id': ['Order with such id does not exist']
+            }),
+            ({'courier_id': 2, 'order_id': 60, 'complete_time': 'now'}, {
+                'order_id': ['Order with such id does not exist'],
+                'complete_time': ['The format is incorrect']
+            }),
+            ({'courier_id': 0, 'order_id': 60}, {
+                'courier_id': ['This field must be positive'],
+                'order_id': ['Order with such id does not exist']
+            }),
+            ({'courier_id': 1, 'order_id': 50}, {
+                'non_field_errors': ['The order was assigned to another courier or not assigned at all']
+            }),
+        ]
+        for data, errors in cases:
+            data.setdefault('complete_time', '2021-01-10T10:33:01.42Z')
+            response = self.client.post(reverse('orders_complete'), data=json.dumps(data), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data, {'validation_error': errors})
+
+    def test_orders_complete_with_non_object_body(self):
+        for body in ([1, 2], 'x', 5):
+            response = self.client.post(reverse('orders_complete'), data=json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('non_field_errors', response.data['validation_error'])
+
     def test_orders_complete_with_invalid_data(self):
         data = {
             'courier_id': self.courier2.courier_id,
@@ -281,4 +578,564 @@ class TestOrders(TestCase):
         data.pop('extra')
         data['order_id'] = 51
         response = self.client.post(reverse('orders_complete'), data=json.dumps(data), content_type='application/json')
-        self.assertEqual(response.status_code, 400)
\ No newline at end of file
+        self.assertEqual(response.status_code, 400)
+
+
+class TestIntervals(SimpleTestCase):
+    def test_compile_intervals(self):
+        self.assertEqual(
+            compile_intervals(['16:00-21:30', '09:00-12:00', '11:30-13:00', '13:00-14:00', '10:00-10:00']),
+            [[540, 840], [960, 1290]]
+        )
+        self.assertEqual(compile_intervals([]), [])
+        self.assertEqual(compile_intervals(None), [])
+
+    def test_intervals_overlap(self):
+        self.assertTrue(intervals_overlap([[540, 600], [700, 800]], [[610, 650], [790, 900]]))
+        self.assertFalse(intervals_overlap([[540, 600], [700, 800]], [[600, 700], [800, 900]]))
+        self.assertFalse(intervals_overlap([], [[0, 1440]]))
+
+    def test_working_and_delivery_hours_overlap(self):
+        for working_hours, delivery_hours, overlap in (
+            (['11:00-12:00'], ['11:00-13:00'], True),
+            (['09:00-11:00', '18:00-20:00'], ['19:59-23:00'], True),
+            (['11:00-12:00'], ['12:00-13:00'], False),
+        ):
+            self.assertEqual(
+                intervals_overlap(compile_intervals(working_hours), compile_intervals(delivery_hours)), overlap
+            )
+
+    def test_intervals_compiled_on_save(self):
+        courier = Courier(courier_id=1, courier_type='foot', regions=[1], working_hours=['12:00-13:00', '09:00-11:00'])
+        courier.compile_hours()
+        self.assertEqual(courier.working_intervals, [[540, 660], [720, 780]])
+        order = Order(order_id=1, weight=1, region=1, delivery_hours=['09:30-10:00'])
+        order.compile_hours()
+        self.assertEqual(order.delivery_intervals, [[570, 600]])
+        self.assertEqual(courier.working_slots, [0, 0xfff << 48, 0xfff << 24 | 0xfff, 0, 0])
+        self.assertEqual(order.delivery_slots, [0, 0x3f << 54, 0, 0, 0])
+
+    def test_compile_slots(self):
+        self.assertEqual(compile_slots([[0, 5], [15, 21]]), [0b11001, 0, 0, 0, 0])
+        self.assertEqual(compile_slots([[0, 1440]]), [(1 << 60) - 1] * 4 + [(1 << 48) - 1])
+        self.assertEqual(compile_slots([]), [0] * 5)
+        self.assertEqual(compile_slots(None), [0] * 5)
+        self.assertEqual(compile_slots([[660, 662]]), compile_slots([[663, 665]]))
+        self.assertFalse(any(i & j for i, j in zip(compile_slots([[540, 600]]), compile_slots([[600, 700]]))))
+
+
+class TestAssignment(SimpleTestCase):
+    def setUp(self):
+        self.orders = []
+        for order_id, weight in enumerate([6, 5, 4, 3.5, 2, 0.01], start=1):
+            order = Order(order_id=order_id, weight=weight, region=order_id % 2 + 1, delivery_hours=['10:00-12:00'])
+            order.compile_hours()
+            self.orders.append(order)
+
+    def test_strategies_respect_capacity(self):
+        for strategy in STRATEGIES:
+            chosen = pack_orders(self.orders, 10, strategy=strategy)
+            self.assertLessEqual(sum(i.weight for i in chosen), 10, strategy)
+            self.assertEqual([i.order_id for i in chosen], sorted(i.order_id for i in chosen))
+
+    def test_lightest_first_maximizes_count(self):
+        chosen = pack_orders(self.orders, 10, strategy='lightest_first')
+        self.assertEqual([i.order_id for i in chosen], [3, 4, 5, 6])
+
+    def test_knapsack_fills_capacity(self):
+        chosen = pack_orders(self.orders, 10, strategy='knapsack')
+        self.assertAlmostEqual(sum(i.weight for i in chosen), 10)
+
+    def test_everything_fits(self):
+        self.assertEqual(pack_orders(self.orders, 50, strategy='knapsack'), self.orders)
+
+    def test_knapsack_falls_back_when_out_of_time(self):
+        chosen = pack_orders(self.orders, 10, strategy='knapsack', time_budget=-1)
+        self.assertEqual(chosen, pack_orders(self.orders, 10, strategy='first_fit_decreasing'))
+
+
+def legacy_rating(courier):
+    # The original per-region loop of the courier detail view, kept as the reference for the rating paths
+    min_time = None
+    for region in courier.regions:
+        orders = Order.objects.filter(
+            courier=courier, region=region
+        ).exclude(complete_time=None).order_by('complete_time')
+        if not orders:
+            continue
+        region_time = [(orders[0].complete_time - orders[0].assign_time).total_seconds()]
+        previous_order_time = orders[0].complete_time
+        for order in orders[1::]:
+            time = (order.complete_time - previous_order_time).total_seconds()
+            region_time.append(time)
+            previous_order_time = order.complete_time
+        avg_time = sum(region_time) / len(region_time)
+        min_time = avg_time if min_time is None else min(sum(region_time) / len(region_time), min_time)
+    return None if min_time is None else round((60*60 - min(min_time, 60*60))/(60*60) * 5, 2)
+
+
+class TestRating(TestCase):
+    def test_rating_paths_match_legacy_loop(self):
+        rnd = random.Random(0)
+        start = dt(2021, 3, 1, 10, tzinfo=tz.utc)
+        ratings = []
+        for courier_id in range(1, 21):
+            courier = Courier.objects.create(
+                courier_id=courier_id, courier_type='car', regions=[1, 2, 3, 4], working_hours=['09:00-18:00']
+            )
+            for i in range(rnd.randint(0, 8)):
+                assign_time = start + datetime.timedelta(minutes=rnd.randint(0, 60))
+                Order.objects.create(
+                    order_id=courier_id * 100 + i, weight=1, region=rnd.randint(1, 5), delivery_hours=['09:00-18:00'],
+                    courier=courier, assign_time=assign_time,
+                    complete_time=assign_time + datetime.timedelta(seconds=rnd.randint(60, 2 * 60 * 60))
+                )
+            for region in range(1, 6):
+                rebuild_region_stats(courier_id, region)
+            ratings.append(legacy_rating(courier))
+            self.assertEqual(calculate_rating(courier), ratings[-1])
+            self.assertEqual(calculate_rating_sql(courier), ratings[-1])
+        self.assertTrue(any(ratings))
+        self.assertIn(None, ratings)
+
+    def test_sql_rating_without_completed_orders(self):
+        courier = Courier.objects.create(courier_id=1, courier_type='car', regions=[1], working_hours=[])
+        self.assertIsNone(calculate_rating_sql(courier))
+        courier.regions = []
+        self.assertIsNone(calculate_rating_sql(courier))
+
+
+class TestJSON(SimpleTestCase):
+    data = {
+        'validation_error': {'orders': [{'id': 1, 'weight': [ErrorDetail('This field must be positive')]}]},
+        'assign_time': dt(2021, 3, 1, 10, 30, 15, 123000, tzinfo=tz.utc),
+        1: 2.5,
+    }
+
+    def test_renderer_matches_drf(self):
+        expected = JSONRenderer().render(self.data)
+        self.assertEqual(json.loads(FastJSONRenderer().render(self.data)), json.loads(expected))
+        with mock.patch('api.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), expected)
+
+    def test_parser(self):
+        body = b'[{"order_id": 1, "delivery_hours": ["09:00-18:00"]}]'
+        expected = [{'order_id': 1, 'delivery_hours': ['09:00-18:00']}]
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)), expected)
+        with mock.patch('api.parsers.orjson', None):
+            self.assertEqual(FastJSONParser().parse(BytesIO(body)), expected)
+
+
+class TestValidators(SimpleTestCase):
+    def test_validate_time_ranges(self):
+        self.assertEqual(validate_time_ranges(['09:00-18:00', '00:00-23:59']), ['09:00-18:00', '00:00-23:59'])
+        for value in (['09:00x18:00'], ['9:00-18:00'], ['24:00-24:30'], ['09:60-10:00'], ['09:00-18:00 '], [900]):
+            with self.assertRaises(ValidationError, msg=value):
+                validate_time_ranges(value)
+        for value in (['18:00-09:00'], ['10:00-10:00']):
+            with self.assertRaisesMessage(ValidationError, 'The interval must end later than it starts'):
+                validate_time_ranges(value)
+
+    def test_validate_positive_integers(self):
+        self.assertEqual(validate_positive_integers([1, 2]), [1, 2])
+        for value in ([0], [-1], ['1'], [True], [1.0]):
+            with self.assertRaises(ValidationError, msg=value):
+                validate_positive_integers(value)
+
+    def test_field_names_cached_per_class(self):
+        serializer = CourierSerializer(data={'courier_id': 1, 'extra': 1})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['non_field_errors'], ['Unknown field: extra'])
+        self.assertEqual(FIELD_NAMES[CourierSerializer], {'courier_id', 'courier_type', 'regions', 'working_hours'})
+
+
+@override_settings(DISPATCH_INDEX_ENABLED=True)
+class TestDispatchIndex(TestCase):
+    def setUp(self):
+        self.courier = Courier.objects.create(
+            courier_id=1, courier_type='bike', regions=[1, 2], working_hours=['11:00-12:00', '18:00-19:00']
+        )
+        self.orders = [
+            Order.objects.create(order_id=10, weight=7, region=1, delivery_hours=['08:00-09:00', '11:30-13:00']),
+            Order.objects.create(order_id=11, weight=15, region=2, delivery_hours=['18:59-20:00']),
+            Order.objects.create(order_id=12, weight=16, region=1, delivery_hours=['11:00-12:00']),
+            Order.objects.create(order_id=13, weight=1, region=3, delivery_hours=['11:00-12:00']),
+            Order.objects.create(order_id=14, weight=1, region=1, delivery_hours=['12:00-18:00']),
+        ]
+        self.index = DispatchIndex()
+        self.index.build()
+
+    def candidate_ids(self):
+        return {i.order_id for i in self.index.candidates(self.courier)}
+
+    def test_cold_index_falls_back(self):
+        index = DispatchIndex()
+        with mock.patch.object(index, 'warm_up') as warm_up:
+            self.assertIsNone(index.candidates(self.courier))
+        warm_up.assert_called_once()
+        with self.settings(DISPATCH_INDEX_ENABLED=False):
+            self.assertIsNone(self.index.candidates(self.courier))
+
+    def test_candidates(self):
+        self.assertEqual(self.candidate_ids(), {10, 11})
+        self.assertEqual(self.index.verify(), {'missing': 0, 'stale': 0})
+
+    def test_add_and_discard(self):
+        self.index.discard([10])
+        self.assertEqual(self.candidate_ids(), {11})
+        self.index.add([self.orders[0]])
+        self.assertEqual(self.candidate_ids(), {10, 11})
+        Order.objects.create(order_id=15, weight=1, region=1, delivery_hours=['11:00-12:00'])
+        Order.objects.filter(order_id=13).update(courier=self.courier)
+        self.assertEqual(self.index.verify(), {'missing': 1, 'stale': 1})
+
+    def test_assign_uses_index(self):
+        with mock.patch('api.service.dispatch_index', self.index), CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                reverse('orders_assign'), data=json.dumps({'courier_id': 1}), content_type='application/json'
+            )
+        self.assertEqual(response.data['orders'], [{'id': 10}])
+        backlog = [i['sql'] for i in context.captured_queries if '"courier_id" IS NULL' in i['sql']]
+        self.assertEqual(len(backlog), 1)
+        self.assertIn('"order_id" IN (10)', backlog[0])
+
+    def test_assign_falls_back_to_sql_when_index_is_short(self):
+        # Imported by another process, so the index hasn't seen it
+        Order.objects.create(order_id=16, weight=5, region=1, delivery_hours=['11:00-12:00'])
+        self.index.discard([11])
+        with mock.patch('api.service.dispatch_index', self.index):
+            response = self.client.post(
+                reverse('orders_assign'), data=json.dumps({'courier_id': 1}), content_type='application/json'
+            )
+        self.assertEqual(response.data['orders'], [{'id': 10}, {'id': 16}])
+
+    def test_assign_rechecks_stale_index(self):
+        Order.objects.filter(order_id=10).update(courier=self.courier, assign_time=dt.now(tz=tz.utc))
+        Order.objects.filter(order_id=10).update(complete_time=dt.now(tz=tz.utc))
+        with mock.patch('api.service.dispatch_index', self.index):
+            response = self.client.post(
+                reverse('orders_assign'), data=json.dumps({'courier_id': 1}), content_type='application/json'
+            )
+        self.assertEqual(response.data['orders'], [{'id': 11}])
+
+    def test_candidates_match_order_weights(self):
+        order = Order.objects.create(order_id=15, weight=0.3, region=2, delivery_hours=['18:00-18:30'])
+        self.index.add([order])
+        candidate = [i for i in self.index.candidates(self.courier) if i.order_id == 15][0]
+        self.assertEqual(candidate, (15, 0.3, 2, order.first_start))
+
+
+class TestOrderListing(TestCase):
+    def setUp(self):
+        self.courier = Courier.objects.create(
+            courier_id=1, courier_type='car', regions=[1, 2], working_hours=['09:00-18:00']
+        )
+        start = dt(2021, 3, 1, 10, tzinfo=tz.utc)
+        for order_id, region, minutes in ((5, 1, 30), (3, 2, 10), (8, 1, 10), (2, 1, None), (9, 2, None), (4, 1, None)):
+            Order.objects.create(
+                order_id=order_id, weight=1, region=region, delivery_hours=['11:00-13:00'],
+                courier=self.courier if order_id != 4 else None, assign_time=start if order_id != 4 else None,
+                complete_time=start + datetime.timedelta(minutes=minutes) if minutes else None
+            )
+
+    def walk(self, url, **params):
+        order_ids = []
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            order_ids.extend(i['order_id'] for i in response.data['orders'])
+            if response.data['next_cursor'] is None:
+                return order_ids
+            params['cursor'] = response.data['next_cursor']
+
+    def test_list_orders(self):
+        self.assertEqual(self.walk(reverse('orders'), limit=2), [2, 3, 4, 5, 8, 9])
+        self.assertEqual(self.walk(reverse('orders'), region=1, status='completed'), [5, 8])
+        self.assertEqual(self.walk(reverse('orders'), status='unassigned'), [4])
+        response = self.client.get(reverse('orders'), {'limit': 1})
+        self.assertEqual(response.data['orders'][0]['complete_time'], None)
+
+    def test_courier_orders(self):
+        url = reverse('couriers_orders', kwargs={'courier_id': 1})
+        self.assertEqual(self.walk(url, limit=1), [3, 8, 5, 2, 9])
+        self.assertEqual(self.walk(url, limit=2, status='active'), [2, 9])
+        with self.assertNumQueries(2):
+            self.client.get(url, {'limit': 2})
+        response = self.client.get(reverse('couriers_orders', kwargs={'courier_id': 2}))
+        self.assertEqual(response.status_code, 400)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plan')
+    def test_courier_pages_seek_along_index(self):
+        queryset = Order.objects.filter(courier=1)
+        ranges = list(key_ranges(queryset, COURIER_ORDER_KEY, [dt(2021, 3, 1, 10, 10, tzinfo=tz.utc), 8]))
+        self.assertEqual([[i['order_id'] for i in part] for part in ranges], [[5], [2, 9]])
+        plans = [i.explain() for i in ranges]
+        self.assertIn('order_courier_history_idx (courier_id=? AND complete_time>?)', plans[0])
+        self.assertIn('order_courier_history_idx (courier_id=? AND complete_time=?)', plans[1])
+        ranges = list(key_ranges(queryset, COURIER_ORDER_KEY, [None, 2]))
+        self.assertEqual([[i['order_id'] for i in part] for part in ranges], [[9]])
+        self.assertIn('order_courier_history_idx (courier_id=? AND complete_time=? AND order_id>?)', ranges[0].explain())
+        self.assertNotIn('TEMP B-TREE', ''.join(plans))
+
+    def test_invalid_parameters(self):
+        for params in ({'cursor': 'abc'}, {'cursor': 'WyJ4Il0='}, {'status': 'lost'}, {'limit': 0}, {'page': 2}):
+            response = self.client.get(reverse('orders'), params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('validation_error', response.data)
+
+    def test_export(self):
+        response = self.client.get(reverse('couriers_orders', kwargs={'courier_id': 1}), {'export': 'true'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(i) for i in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([i['order_id'] for i in rows], [3, 8, 5, 2, 9])
+        self.assertEqual(rows[0]['complete_time'], '2021-03-01T10:10:00Z')
+
+
+@override_settings(COURIER_CACHE_ENABLED=False)
+class TestArchive(TestCase):
+    def setUp(self):
+        self.courier = Courier.objects.create(
+            courier_id=1, courier_type='car', regions=[1, 2], working_hours=['09:00-18:00']
+        )
+        old = tz.now() - datetime.timedelta(days=100)
+        recent = tz.now() - datetime.timedelta(days=1)
+        for order_id, region, start, minutes in ((1, 1, old, 20), (2, 2, old, 40), (3, 1, recent, 30), (4, 1, recent, None)):
+            Order.objects.create(
+                order_id=order_id, weight=1, region=region, delivery_hours=['11:00-13:00'], courier=self.courier,
+                assign_time=start, complete_time=start + datetime.timedelta(minutes=minutes) if minutes else None
+            )
+        for region in (1, 2):
+            rebuild_region_stats(1, region)
+        self.url = reverse('couriers_detail', kwargs={'courier_id': 1})
+
+    def test_archive_keeps_profile(self):
+        before = self.client.get(self.url).data
+        call_command('archive_orders', days=30, batch_size=1, stdout=StringIO())
+        self.assertEqual(sorted(Order.objects.values_list('order_id', flat=True)), [3, 4])
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('order_id', flat=True)), [1, 2])
+        self.assertEqual(sum(self.courier.region_stats.values_list('archived_count', flat=True)), 2)
+        after = self.client.get(self.url).data
+        self.assertEqual((after['earnings'], after['rating']), (before['earnings'], before['rating']))
+        self.assertEqual(after['earnings'], 4 * 500 * 10)
+        rebuild_region_stats(1, 1)
+        self.assertEqual(calculate_rating(self.courier), before['rating'])
+        self.assertEqual(calculate_rating_sql(self.courier), before['rating'])
+
+    def test_archived_orders_listing_and_import(self):
+        archive_orders(tz.now() - datetime.timedelta(days=30))
+        response = self.client.get(reverse('couriers_orders', kwargs={'courier_id': 1}), {'archived': 'true'})
+        self.assertEqual([i['order_id'] for i in response.data['orders']], [1, 2])
+        data = [{'order_id': 1, 'weight': 1, 'region': 1, 'delivery_hours': ['11:00-13:00']}]
+        response = self.client.post(reverse('orders'), data=json.dumps(data), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestIndexes(TestCase):
+    def get_queries(self):
+        courier = Courier.objects.create(
+            courier_id=1, courier_type='bike', regions=[1, 2], working_hours=['09:00-18:00']
+        )
+        return [
+            (get_candidate_orders(courier), 'order_unassigned_idx'),
+            (Order.objects.filter(courier=None).values('region'), 'order_unassigned_idx'),
+            (get_active_orders(1).order_by('order_id'), 'order_courier_history_idx'),
+            (get_completed_orders(1, [1, 2]).order_by('complete_time'), 'order_courier_history_idx'),
+            (Order.objects.filter(courier=1).exclude(assign_time=None), 'order_courier_history_idx'),
+        ]
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite query plan')
+    def test_sqlite_uses_partial_indexes(self):
+        for queryset, index in self.get_queries():
+            self.assertIn('USING INDEX {}'.format(index), queryset.explain())
+
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL query plan')
+    def test_postgresql_uses_partial_indexes(self):
+        queries = self.get_queries()
+        with connection.cursor() as cursor:
+            # The test tables are tiny, so a sequential scan would otherwise always win
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        for queryset, index in queries:
+            self.assertIn(index, queryset.explain())
+
+
+@override_settings(ROOT_URLCONF='api.async_urls')
+class TestAsyncViews(TransactionTestCase):
+    def setUp(self):
+        get_cache().clear()
+
+    def test_async_views(self):
+        Courier.objects.create(courier_id=1, courier_type='bike', regions=[1], working_hours=['11:00-12:00'])
+        Order.objects.create(order_id=1, weight=1, region=1, delivery_hours=['11:00-13:00'])
+        client = AsyncClient()
+        response = async_to_sync(client.post)(
+            reverse('orders_assign'), data={'courier_id': 1}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['orders'], [{'id': 1}])
+        response = async_to_sync(client.get)(reverse('couriers_detail', kwargs={'courier_id': 1}))
+        self.assertEqual(json.loads(response.content)['earnings'], 2500)
+
+    @override_settings(ASYNC_STREAM_BUFFER=2)
+    def test_async_export_is_streamed(self):
+        courier = Courier.objects.create(courier_id=1, courier_type='car', regions=[1], working_hours=['09:00-18:00'])
+        for order_id in range(1, 11):
+            Order.objects.create(
+                order_id=order_id, weight=1, region=1, delivery_hours=['10:00-11:00'],
+                courier=courier, assign_time=dt.now(tz=tz.utc)
+            )
+        produced = []
+        messages = []
+
+        def tracked_stream(*args, **kwargs):
+            for chunk in stream_ndjson(*args, **kwargs):
+                produced.append(chunk)
+                yield chunk
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append((message, len(produced)))
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': reverse('couriers_orders', kwargs={'courier_id': 1}),
+            'query_string': b'export=true', 'headers': [(b'host', b'testserver')],
+        }
+        with mock.patch('api.views.stream_ndjson', tracked_stream):
+            async_to_sync(ASGIHandler())(scope, receive, send)
+        self.assertEqual(messages[0][0]['status'], 200)
+        bodies = [(i['body'], count) for i, count in messages[1:] if i.get('body')]
+        self.assertEqual(len(bodies), 10)
+        self.assertLessEqual(bodies[0][1], 4)
+        rows = [json.loads(i) for i in b''.join(i for i, _ in bodies).splitlines()]
+        self.assertEqual([i['order_id'] for i in rows], list(range(1, 11)))
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_async_views_run_concurrently_with_metrics(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def slow_view(view, request, *args, **kwargs):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.2)
+            with lock:
+                running[0] -= 1
+            return run_view(view, request, *args, **kwargs)
+
+        async def fetch_all():
+            client = AsyncClient()
+            return await asyncio.gather(*(client.get(reverse('cache_stats')) for _ in range(8)))
+
+        registry.clear()
+        with mock.patch('api.async_views.run_view', slow_view):
+            responses = async_to_sync(fetch_all)()
+        self.assertEqual([i.status_code for i in responses], [200] * 8)
+        self.assertEqual(running[1], 8)
+        lines = registry.render().splitlines()
+        self.assertIn('api_requests_total{endpoint="cache_stats",method="GET",status="200"} 8', lines)
+
+
+@override_settings(COURIER_CACHE_ENABLED=True)
+class TestCourierCache(TransactionTestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.courier = Courier.objects.create(
+            courier_id=1, courier_type='bike', regions=[1], working_hours=['11:00-12:00']
+        )
+        Order.objects.create(order_id=1, weight=1, region=1, delivery_hours=['11:00-13:00'])
+        self.url = reverse('couriers_detail', kwargs={'courier_id': 1})
+
+    def test_cache_invalidation(self):
+        stats = get_stats()
+        self.assertEqual(self.client.get(self.url).data['earnings'], 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url).data['earnings'], 0)
+        response = self.client.post(
+            reverse('orders_assign'), data=json.dumps({'courier_id': 1}), content_type='application/json'
+        )
+        self.assertEqual(self.client.get(self.url).data['earnings'], 2500)
+        data = {
+            'courier_id': 1, 'order_id': 1,
+            'complete_time': (dt.fromisoformat(response.data['assign_time'][:-1]) + datetime.timedelta(minutes=30))
+            .strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        }
+        self.client.post(reverse('orders_complete'), data=json.dumps(data), content_type='application/json')
+        self.assertEqual(self.client.get(self.url).data['rating'], 2.5)
+        self.client.patch(self.url, data=json.dumps({'courier_type': 'car'}), content_type='application/json')
+        self.assertEqual(self.client.get(self.url).data['courier_type'], 'car')
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(response.data['hits'] - stats['hits'], 1)
+        self.assertEqual(response.data['misses'] - stats['misses'], 4)
+        self.assertEqual(response.data['invalidations'] - stats['invalidations'], 3)
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        registry.clear()
+        Courier.objects.create(courier_id=1, courier_type='bike', regions=[1], working_hours=['11:00-12:00'])
+        Order.objects.create(order_id=1, weight=1, region=1, delivery_hours=['11:00-13:00'])
+
+    def assign(self):
+        return self.client.post(
+            reverse('orders_assign'), data=json.dumps({'courier_id': 1}), content_type='application/json'
+        )
+
+    def test_metrics(self):
+        self.assign()
+        self.assign()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        labels = 'endpoint="orders_assign",method="POST"'
+        self.assertIn('api_requests_total{%s,status="200"} 2' % labels, lines)
+        self.assertIn('api_request_duration_seconds_count{%s} 2' % labels, lines)
+        self.assertIn('api_request_duration_seconds_bucket{%s,le="+Inf"} 2' % labels, lines)
+        self.assertIn('api_stage_duration_seconds_count{%s,stage="candidates"} 1' % labels, lines)
+        queries = [i for i in lines if i.startswith('api_db_queries_total{%s}' % labels)]
+        self.assertGreater(int(queries[0].split()[1]), 2)
+        self.assertNotIn('endpoint="metrics"', response.content.decode())
+
+    def test_server_timing(self):
+        self.assertNotIn('Server-Timing', self.assign())
+        with override_settings(METRICS_SERVER_TIMING=True):
+            header = self.assign()['Server-Timing']
+        self.assertEqual([i.split(';')[0] for i in header.split(', ')], ['db', 'validation', 'total'])
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(SimpleTestCase):
+    def setUp(self):
+        self.checked = []
+        self.pool = ConnectionPool(
+            FakeConnection, lambda i: self.checked.append(i) or not i.closed, lambda i: not i.closed,
+            max_size=2, timeout=0.01, health_check_interval=60
+        )
+
+    def test_reuses_connections(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertIsNot(first, second)
+        with self.assertRaises(PoolTimeout):
+            self.pool.acquire()
+        self.pool.release(first)
+        self.assertIs(self.pool.acquire(), first)
+
+    def test_discards_broken_connections(self):
+        first = self.pool.acquire()
+        self.pool.release(first)
+        first.closed = True
+        second = self.pool.acquire()
+        self.assertIsNot(first, second)
+        self.pool.release(second)
+        self.pool.health_check_interval = 0
+        self.assertIs(self.pool.acquire(), second)
+        self.assertEqual(self.checked, [second])
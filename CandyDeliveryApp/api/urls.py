@@ -1,12 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import (api_couriers, api_couriers_detail, api_orders,
-                    api_orders_assign, api_orders_complete)
+from . import async_views, views
+from .metrics import metrics_view
 
-urlpatterns = [
-    path('couriers/', api_couriers, name='couriers'),
-    path('couriers/<int:courier_id>/', api_couriers_detail, name='couriers_detail'),
-    path('orders/', api_orders, name='orders'),
-    path('orders/assign/', api_orders_assign, name='orders_assign'),
-    path('orders/complete/', api_orders_complete, name='orders_complete'),
-]
+
+def build_urlpatterns(views):
+    return [
+        path('couriers/', views.api_couriers, name='couriers'),
+        path('couriers/<int:courier_id>/', views.api_couriers_detail, name='couriers_detail'),
+        path('couriers/<int:courier_id>/orders/', views.api_couriers_orders, name='couriers_orders'),
+        path('orders/', views.api_orders, name='orders'),
+        path('orders/stream/', views.api_orders_stream, name='orders_stream'),
+        path('orders/assign/', views.api_orders_assign, name='orders_assign'),
+        path('orders/complete/', views.api_orders_complete, name='orders_complete'),
+        path('orders/dispatch/', views.api_orders_dispatch, name='orders_dispatch'),
+        path('stats/cache/', views.api_cache_stats, name='cache_stats'),
+        path('metrics/', metrics_view, name='metrics'),
+    ]
+
+
+urlpatterns = build_urlpatterns(async_views if settings.API_ASYNC_VIEWS else views)
@@ -0,0 +1,25 @@
+import re
+
+from rest_framework import serializers
+
+TIME_RANGE_RE = re.compile(r'^([01]\d|2[0-3]):([0-5]\d)-([01]\d|2[0-3]):([0-5]\d)$')
+
+
+def validate_positive_integers(value):
+    for i in value:
+        if type(i) is not int or i <= 0:
+            raise serializers.ValidationError('The array must be composed of positive integers')
+    return value
+
+
+def validate_time_ranges(value):
+    for i in value:
+        if not isinstance(i, str):
+            raise serializers.ValidationError('The array must be composed of strings')
+        match = TIME_RANGE_RE.match(i)
+        if match is None:
+            raise serializers.ValidationError('The format of the array elements is incorrect')
+        start_hours, start_minutes, end_hours, end_minutes = match.groups()
+        if (start_hours, start_minutes) >= (end_hours, end_minutes):
+            raise serializers.ValidationError('The interval must end later than it starts')
+    return value
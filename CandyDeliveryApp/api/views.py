@@ -1,79 +1,79 @@
-from datetime import datetime as dt
-
+from django.conf import settings
+from django.db import transaction
 from django.forms import model_to_dict
-from orders.models import COURIER_EARNINGS_COEFFICIENTS, Courier, Order
+from django.http import StreamingHttpResponse
+from orders.models import (COURIER_EARNINGS_COEFFICIENTS, ArchivedOrder,
+                           Courier, Order)
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes
 from rest_framework.response import Response
 
+from .cache import (get_courier_profile, get_stats, invalidate_couriers,
+                    set_courier_profile)
+from .dispatch_index import dispatch_index
+from .dispatcher import dispatch_orders
+from .ingest import ingest_orders, request_lines
+from .listing import (COURIER_ORDER_KEY, ORDER_KEY, filter_orders, get_page,
+                      stream_ndjson)
+from .metrics import stage
 from .serializers import (CourierSerializer, OrderAssignmentSerializer,
-                          OrderCompletionSerializer, OrderSerializer)
-from .service import check_courier_and_orders_compatibility, dict_to_json
+                          OrderCompletionSerializer, OrderDispatchSerializer,
+                          OrderListSerializer, OrderSerializer)
+from .service import (REASSIGNMENT_FIELDS, assign_orders, complete_order,
+                      count_assigned_orders, get_courier_rating,
+                      release_incompatible_orders)
 
 
 @api_view(['POST'])
 def api_couriers(request):
-    result = []
     serializer = CourierSerializer(data=request.data, many=True)
-    if serializer.is_valid():
-        serializer.save()
-        data = serializer.data
-        for i in data:
-            result.append({'id': i['courier_id']})
-        result = {'couriers': result}
-        return Response(dict_to_json(result), status=status.HTTP_201_CREATED)
+    with stage('validation'):
+        valid = serializer.is_valid()
+    if valid:
+        with stage('write'):
+            serializer.save()
+        result = {'couriers': [{'id': i['courier_id']} for i in serializer.validated_data]}
+        return Response(result, status=status.HTTP_201_CREATED)
+    if not isinstance(serializer.errors, list):
+        return Response({'validation_error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
     result = []
-    for i in request.data:
-        serializer = CourierSerializer(data=i)
-        if serializer.is_valid():
+    for item, errors in zip(request.data, serializer.errors):
+        if not errors:
             continue
-        result.append({'id': serializer.data.get('courier_id')})
-        result[-1].update(serializer.errors)
+        result.append({'id': item.get('courier_id') if isinstance(item, dict) else None})
+        result[-1].update(errors)
     result = {'validation_error': {'couriers': result}}
-    return Response(dict_to_json(result), status=status.HTTP_400_BAD_REQUEST)
+    return Response(result, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['PATCH', 'GET'])
 def api_couriers_detail(request, courier_id):
-    courier = Courier.objects.filter(courier_id=courier_id)
-    if not courier:
-        return Response(dict_to_json({'validation_error': {'courier_id': 'Courier with such id does not exist'}}),
+    if request.method == 'GET':
+        profile, version = get_courier_profile(courier_id)
+        if profile is not None:
+            return Response(profile)
+    courier = Courier.objects.filter(courier_id=courier_id).first()
+    if courier is None:
+        return Response({'validation_error': {'courier_id': 'Courier with such id does not exist'}},
                         status=status.HTTP_400_BAD_REQUEST)
-    courier = Courier.objects.get(courier_id=courier_id)
     if request.method == 'PATCH':
         serializer = CourierSerializer(courier, data=request.data, partial=True)
-        if serializer.is_valid():
-            serializer.save()
-            orders = Order.objects.filter(courier=courier_id)
-            suitable_orders = check_courier_and_orders_compatibility(courier_id, courier_id)
-            for order in orders:
-                if order not in suitable_orders:
-                    order.courier = None
-                    order.assign_time = None
-                    order.save()
+        with stage('validation'):
+            valid = serializer.is_valid()
+        if valid:
+            previous = {i: getattr(courier, i) for i in REASSIGNMENT_FIELDS}
+            with stage('write'), transaction.atomic():
+                serializer.save()
+                release_incompatible_orders(courier, previous)
+                invalidate_couriers([courier.courier_id])
             return Response(serializer.data, status=status.HTTP_200_OK)
-        errors = dict_to_json({'validation_error': serializer.errors})
+        errors = {'validation_error': serializer.errors}
         return Response(errors, status=status.HTTP_400_BAD_REQUEST)
     if request.method == 'GET':
-        min_time = None
-        for region in courier.regions:
-            orders = Order.objects.filter(
-                courier=courier, region=region
-            ).exclude(complete_time=None).order_by('complete_time')
-            if not orders:
-                continue
-            region_time = [(orders[0].complete_time - orders[0].assign_time).total_seconds()]
-            previous_order_time = orders[0].complete_time
-            for order in orders[1::]:
-                time = (order.complete_time - previous_order_time).total_seconds()
-                region_time.append(time)
-                previous_order_time = order.complete_time
-            avg_time = sum(region_time) / len(region_time)
-            min_time = avg_time if min_time is None else min(sum(region_time) / len(region_time), min_time)
-
-        rating = None if min_time is None else round((60*60 - min(min_time, 60*60))/(60*60) * 5, 2)
-
-        orders_number = Order.objects.filter(courier=courier).exclude(assign_time=None).count()
+        with stage('rating'):
+            rating = get_courier_rating(courier)
+
+        orders_number = count_assigned_orders(courier)
         earnings = orders_number * 500 * COURIER_EARNINGS_COEFFICIENTS[courier.courier_type]
 
         result = model_to_dict(courier)
@@ -81,69 +81,123 @@ def api_couriers_detail(request, courier_id):
         if rating is not None:
             result.update({'rating': rating})
 
-        result = dict_to_json(result)
+        set_courier_profile(courier_id, version, result)
         return Response(result)
 
 
-@api_view(['POST'])
+def list_orders(request, key, **filters):
+    serializer = OrderListSerializer(data=request.query_params, context={'key': key})
+    with stage('validation'):
+        valid = serializer.is_valid()
+    if not valid:
+        errors = {'validation_error': serializer.errors}
+        return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+    params = serializer.validated_data
+    model = ArchivedOrder if params.get('archived') else Order
+    queryset = filter_orders(model.objects.filter(**filters), params.get('region'), params.get('status'))
+    if params.get('export'):
+        return StreamingHttpResponse(
+            stream_ndjson(queryset, key, params.get('cursor')), content_type='application/x-ndjson'
+        )
+    limit = params.get('limit', settings.ORDER_LIST_PAGE_SIZE)
+    with stage('read'):
+        orders, next_cursor = get_page(queryset, key, limit, params.get('cursor'))
+    return Response({'orders': orders, 'next_cursor': next_cursor})
+
+
+@api_view(['GET'])
+def api_couriers_orders(request, courier_id):
+    if not Courier.objects.filter(courier_id=courier_id).exists():
+        return Response({'validation_error': {'courier_id': 'Courier with such id does not exist'}},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return list_orders(request, COURIER_ORDER_KEY, courier=courier_id)
+
+
+@api_view(['GET'])
+def api_cache_stats(request):
+    return Response(get_stats())
+
+
+@api_view(['GET', 'POST'])
 def api_orders(request):
-    result = []
+    if request.method == 'GET':
+        return list_orders(request, ORDER_KEY)
     serializer = OrderSerializer(data=request.data, many=True)
-    if serializer.is_valid():
-        serializer.save()
-        data = serializer.data
-        for i in data:
-            result.append({'id': i['order_id']})
-        result = {'orders': result}
-        return Response(dict_to_json(result), status=status.HTTP_201_CREATED)
+    with stage('validation'):
+        valid = serializer.is_valid()
+    if valid:
+        with stage('write'):
+            orders = serializer.save()
+        dispatch_index.add(orders)
+        result = {'orders': [{'id': i['order_id']} for i in serializer.validated_data]}
+        return Response(result, status=status.HTTP_201_CREATED)
+    if not isinstance(serializer.errors, list):
+        return Response({'validation_error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
     result = []
-    for i in request.data:
-        serializer = OrderSerializer(data=i)
-        if serializer.is_valid():
+    for item, errors in zip(request.data, serializer.errors):
+        if not errors:
             continue
-        result.append({'id': serializer.data.get('order_id')})
-        result[-1].update(serializer.errors)
+        result.append({'id': item.get('order_id') if isinstance(item, dict) else None})
+        result[-1].update(errors)
     result = {'validation_error': {'orders': result}}
-    return Response(dict_to_json(result), status=status.HTTP_400_BAD_REQUEST)
+    return Response(result, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['POST'])
+@parser_classes([])
+def api_orders_stream(request):
+    lines = request_lines(request)
+    if lines is None:
+        errors = {'validation_error': {'body': 'Send a Content-Length or a chunked body'}}
+        return Response(errors, status=status.HTTP_411_LENGTH_REQUIRED)
+    created, errors = ingest_orders(lines)
+    result = {'orders': [{'id': i} for i in created]}
+    if errors:
+        result['validation_error'] = {'orders': errors}
+        return Response(result, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result, status=status.HTTP_201_CREATED)
 
 
 @api_view(['POST'])
 def api_orders_assign(request):
     serializer = OrderAssignmentSerializer(data=request.data)
-    if serializer.is_valid():
-        courier = Courier.objects.get(courier_id=serializer.data.get('courier_id'))
-        result = []
-        assign_orders = courier.orders.filter(complete_time=None)
-        if assign_orders:
-            for i in assign_orders:
-                result.append({'id': i.order_id})
-            date_str = assign_orders[0].assign_time.isoformat('T') + 'Z'
-        else:
-            suitable_orders = check_courier_and_orders_compatibility(courier.courier_id)
-            date_str = dt.now().isoformat('T') + 'Z'
-            for i in suitable_orders:
-                i.courier = courier
-                i.assign_time = date_str
-                i.save()
-                result.append({'id': i.order_id})
+    with stage('validation'):
+        valid = serializer.is_valid()
+    if valid:
+        order_ids, date_str = assign_orders(serializer.data.get('courier_id'))
+        result = [{'id': i} for i in order_ids]
         result = {'orders': result, 'assign_time': date_str} if result else {'orders': result}
-        result = dict_to_json(result)
         return Response(result, status=status.HTTP_200_OK)
-    errors = dict_to_json({'validation_error': serializer.errors})
+    errors = {'validation_error': serializer.errors}
+    return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['POST'])
+def api_orders_dispatch(request):
+    serializer = OrderDispatchSerializer(data=request.data)
+    with stage('validation'):
+        valid = serializer.is_valid()
+    if valid:
+        assignments, date_str = dispatch_orders(serializer.validated_data.get('courier_ids'))
+        result = [
+            {'id': courier_id, 'orders': [{'id': i} for i in order_ids]}
+            for courier_id, order_ids in assignments.items()
+        ]
+        result = {'couriers': result, 'assign_time': date_str} if result else {'couriers': result}
+        return Response(result, status=status.HTTP_200_OK)
+    errors = {'validation_error': serializer.errors}
     return Response(errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['POST'])
 def api_orders_complete(request):
     serializer = OrderCompletionSerializer(data=request.data)
-    if serializer.is_valid():
-        courier = Courier.objects.get(courier_id=serializer.data.get('courier_id'))
-        order = Order.objects.get(order_id=serializer.data.get('order_id'), courier=courier)
-        order.completed = True
-        order.complete_time = dt.strptime(serializer.data.get('complete_time'), "%Y-%m-%dT%H:%M:%S.%fZ")
-        order.save()
-        result = {'order_id': order.order_id}
-        result = dict_to_json(result)
-        return Response(result, status=status.HTTP_200_OK)
-    errors = dict_to_json({'validation_error': serializer.errors})
+    with transaction.atomic():
+        with stage('validation'):
+            valid = serializer.is_valid()
+        if valid:
+            order = complete_order(serializer.validated_data['order'], serializer.validated_data['complete_time'])
+            result = {'order_id': order.order_id}
+            return Response(result, status=status.HTTP_200_OK)
+    errors = {'validation_error': serializer.errors}
     return Response(errors, status=status.HTTP_400_BAD_REQUEST)
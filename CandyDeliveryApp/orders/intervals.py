@@ -0,0 +1,48 @@
+# The day is packed into 5-minute slots, 60 slots (5 hours) per 64-bit column
+SLOT_MINUTES = 5
+SLOTS_PER_COLUMN = 60
+SLOT_COLUMNS = 5
+
+
+def parse_time_range(value):
+    start = int(value[0:2]) * 60 + int(value[3:5])
+    end = int(value[6:8]) * 60 + int(value[9:11])
+    return start, end
+
+
+def compile_intervals(time_ranges):
+    merged = []
+    for start, end in sorted(parse_time_range(i) for i in time_ranges or ()):
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def intervals_overlap(first, second):
+    i = j = 0
+    while i < len(first) and j < len(second):
+        if first[i][0] < second[j][1] and first[i][1] > second[j][0]:
+            return True
+        if first[i][1] <= second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
+def compile_slots(intervals):
+    masks = [0] * SLOT_COLUMNS
+    for start, end in intervals or ():
+        first = start // SLOT_MINUTES
+        last = -(-end // SLOT_MINUTES)
+        for column in range(SLOT_COLUMNS):
+            offset = column * SLOTS_PER_COLUMN
+            low = max(first, offset)
+            high = min(last, offset + SLOTS_PER_COLUMN)
+            if low < high:
+                masks[column] |= ((1 << (high - low)) - 1) << (low - offset)
+    return masks
@@ -0,0 +1,50 @@
+# Generated by Django 3.1.7 on 2026-10-18 08:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from orders.intervals import compile_intervals
+
+
+def compile_in_batches(queryset, source, target, batch_size=2000):
+    batch = []
+    for obj in queryset.only(source).iterator(chunk_size=batch_size):
+        setattr(obj, target, compile_intervals(getattr(obj, source)))
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            queryset.model.objects.bulk_update(batch, [target], batch_size=500)
+            batch = []
+    queryset.model.objects.bulk_update(batch, [target], batch_size=500)
+
+
+def compile_hours(apps, schema_editor):
+    Courier = apps.get_model('orders', 'Courier')
+    Order = apps.get_model('orders', 'Order')
+    compile_in_batches(Courier.objects.all(), 'working_hours', 'working_intervals')
+    compile_in_batches(Order.objects.all(), 'delivery_hours', 'delivery_intervals')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courier',
+            name='working_intervals',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_intervals',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='courier',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='orders.courier'),
+        ),
+        migrations.RunPython(compile_hours, migrations.RunPython.noop),
+    ]
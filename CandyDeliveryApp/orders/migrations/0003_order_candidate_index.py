@@ -0,0 +1,17 @@
+# Generated by Django 3.1.7 on 2026-10-18 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_compiled_intervals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['courier', 'region', 'weight'], name='order_candidate_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.7 on 2026-10-18 08:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_region_stats(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    CourierRegionStats = apps.get_model('orders', 'CourierRegionStats')
+    stats = {}
+    orders = Order.objects.exclude(courier=None).exclude(complete_time=None).order_by('complete_time')
+    for order in orders.iterator():
+        key = (order.courier_id, order.region)
+        if key not in stats:
+            stats[key] = CourierRegionStats(courier_id=order.courier_id, region=order.region)
+        item = stats[key]
+        start = order.assign_time if item.last_complete_time is None else item.last_complete_time
+        item.completed_count += 1
+        item.delivery_seconds += (order.complete_time - start).total_seconds()
+        item.last_complete_time = order.complete_time
+    CourierRegionStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_candidate_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourierRegionStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.IntegerField()),
+                ('completed_count', models.IntegerField(default=0)),
+                ('delivery_seconds', models.FloatField(default=0)),
+                ('last_complete_time', models.DateTimeField(blank=True, null=True)),
+                ('courier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='region_stats', to='orders.courier')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='courierregionstats',
+            constraint=models.UniqueConstraint(fields=('courier', 'region'), name='courier_region_stats_unique'),
+        ),
+        migrations.RunPython(fill_region_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 3.1.7 on 2026-10-18 08:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_schedule(apps, schema_editor):
+    Courier = apps.get_model('orders', 'Courier')
+    CourierRegion = apps.get_model('orders', 'CourierRegion')
+    CourierShift = apps.get_model('orders', 'CourierShift')
+    regions = []
+    shifts = []
+    for courier in Courier.objects.iterator():
+        regions.extend(CourierRegion(courier_id=courier.pk, region=i) for i in set(courier.regions or []))
+        shifts.extend(CourierShift(courier_id=courier.pk, start=i[0], end=i[1]) for i in courier.working_intervals or [])
+    CourierRegion.objects.bulk_create(regions, batch_size=500)
+    CourierShift.objects.bulk_create(shifts, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_courier_region_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourierShift',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.IntegerField()),
+                ('end', models.IntegerField()),
+                ('courier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shifts', to='orders.courier')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CourierRegion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('region', models.IntegerField()),
+                ('courier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='region_links', to='orders.courier')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='couriershift',
+            index=models.Index(fields=['start', 'end'], name='courier_shift_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='courierregion',
+            index=models.Index(fields=['region', 'courier'], name='courier_region_region_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='courierregion',
+            constraint=models.UniqueConstraint(fields=('courier', 'region'), name='courier_region_unique'),
+        ),
+        migrations.RunPython(fill_schedule, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.7 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_courier_region_and_shift'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['courier', 'complete_time', 'order_id'], name='order_courier_history_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.1.7 on 2026-10-18 08:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_courier_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courierregionstats',
+            name='archived_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('order_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('weight', models.FloatField()),
+                ('region', models.IntegerField()),
+                ('delivery_hours', models.JSONField()),
+                ('completed', models.BooleanField(default=True)),
+                ('assign_time', models.DateTimeField(blank=True, null=True)),
+                ('complete_time', models.DateTimeField()),
+                ('archive_time', models.DateTimeField(auto_now_add=True)),
+                ('courier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_orders', to='orders.courier')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['courier', 'complete_time', 'order_id'], name='archived_order_history_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.1.7 on 2026-10-18 08:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_archived_order'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_candidate_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_courier_history_idx',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='courier',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='orders.courier'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(courier=None), fields=['region', 'weight'], name='order_unassigned_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(courier__isnull=False), fields=['courier', 'complete_time', 'order_id'], name='order_courier_history_idx'),
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 3.1.7 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+from orders.intervals import compile_slots
+
+
+def compile_in_batches(queryset, source, prefix, batch_size=2000):
+    fields = ['%s_%d' % (prefix, i) for i in range(5)]
+    batch = []
+    for obj in queryset.only(source).iterator(chunk_size=batch_size):
+        for field, mask in zip(fields, compile_slots(getattr(obj, source))):
+            setattr(obj, field, mask)
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            queryset.model.objects.bulk_update(batch, fields, batch_size=500)
+            batch = []
+    queryset.model.objects.bulk_update(batch, fields, batch_size=500)
+
+
+def compile_hours(apps, schema_editor):
+    Courier = apps.get_model('orders', 'Courier')
+    Order = apps.get_model('orders', 'Order')
+    compile_in_batches(Courier.objects.all(), 'working_intervals', 'working_slots')
+    compile_in_batches(Order.objects.all(), 'delivery_intervals', 'delivery_slots')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_partial_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courier',
+            name='working_slots_0',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='courier',
+            name='working_slots_1',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='courier',
+            name='working_slots_2',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='courier',
+            name='working_slots_3',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='courier',
+            name='working_slots_4',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_slots_0',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_slots_1',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_slots_2',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_slots_3',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='delivery_slots_4',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compile_hours, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,9 @@
+import copy
+
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+
+from .intervals import SLOT_COLUMNS, compile_intervals, compile_slots
 
 COURIERS_TYPE_AND_WEIGHT_MAPPING = {
     'foot': 10,
@@ -14,6 +18,25 @@ COURIER_EARNINGS_COEFFICIENTS = {
 }
 
 
+class CourierQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for courier in objs:
+            courier.compile_hours()
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            sync_schedule(objs, replace=False)
+        return objs
+
+
+class OrderQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for order in objs:
+            order.compile_hours()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Courier(models.Model):
     courier_id = models.IntegerField(primary_key=True, validators=[MinValueValidator(1)])
     TYPE_CHOICES = (
@@ -27,6 +50,42 @@ class Courier(models.Model):
     )
     regions = models.JSONField(null=True, blank=True)
     working_hours = models.JSONField(null=True, blank=True)
+    working_intervals = models.JSONField(null=True, blank=True, editable=False)
+    working_slots_0 = models.BigIntegerField(default=0, editable=False)
+    working_slots_1 = models.BigIntegerField(default=0, editable=False)
+    working_slots_2 = models.BigIntegerField(default=0, editable=False)
+    working_slots_3 = models.BigIntegerField(default=0, editable=False)
+    working_slots_4 = models.BigIntegerField(default=0, editable=False)
+
+    objects = CourierQuerySet.as_manager()
+
+    @property
+    def working_slots(self):
+        return [getattr(self, 'working_slots_%d' % i) for i in range(SLOT_COLUMNS)]
+
+    def compile_hours(self):
+        self.working_intervals = compile_intervals(self.working_hours)
+        for i, mask in enumerate(compile_slots(self.working_intervals)):
+            setattr(self, 'working_slots_%d' % i, mask)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        courier = super().from_db(db, field_names, values)
+        schedule = courier.__dict__.get('regions'), courier.__dict__.get('working_hours')
+        courier._saved_schedule = copy.deepcopy(schedule)
+        return courier
+
+    def save(self, *args, **kwargs):
+        self.compile_hours()
+        saved = None if self._state.adding else getattr(self, '_saved_schedule', None)
+        schedule = self.regions, self.working_hours
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if saved is None:
+                sync_schedule([self])
+            elif saved != schedule:
+                sync_schedule([self], regions=saved[0] != schedule[0], shifts=saved[1] != schedule[1])
+        self._saved_schedule = copy.deepcopy(schedule)
 
 
 class Order(models.Model):
@@ -34,7 +93,122 @@ class Order(models.Model):
     weight = models.FloatField()
     region = models.IntegerField(validators=[MinValueValidator(1)])
     delivery_hours = models.JSONField()
-    courier = models.ForeignKey(Courier, null=True, on_delete=models.SET_NULL, blank=True, related_name='orders')
+    delivery_intervals = models.JSONField(null=True, blank=True, editable=False)
+    courier = models.ForeignKey(
+        Courier, null=True, on_delete=models.SET_NULL, blank=True, related_name='orders', db_index=False
+    )
     completed = models.BooleanField(default=False)
     assign_time = models.DateTimeField(null=True, blank=True)
     complete_time = models.DateTimeField(null=True, blank=True)
+    delivery_slots_0 = models.BigIntegerField(default=0, editable=False)
+    delivery_slots_1 = models.BigIntegerField(default=0, editable=False)
+    delivery_slots_2 = models.BigIntegerField(default=0, editable=False)
+    delivery_slots_3 = models.BigIntegerField(default=0, editable=False)
+    delivery_slots_4 = models.BigIntegerField(default=0, editable=False)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        # Partial indexes splitting the table into the open backlog and the orders of each courier,
+        # they replace the plain courier index. SQLite only uses them when the query repeats the
+        # condition or implies it (courier_id = X)
+        indexes = [
+            models.Index(
+                fields=['region', 'weight'], condition=models.Q(courier=None), name='order_unassigned_idx'
+            ),
+            models.Index(
+                fields=['courier', 'complete_time', 'order_id'], condition=models.Q(courier__isnull=False),
+                name='order_courier_history_idx'
+            ),
+        ]
+
+    @property
+    def first_start(self):
+        return self.delivery_intervals[0][0] if self.delivery_intervals else 0
+
+    @property
+    def delivery_slots(self):
+        return [getattr(self, 'delivery_slots_%d' % i) for i in range(SLOT_COLUMNS)]
+
+    def compile_hours(self):
+        self.delivery_intervals = compile_intervals(self.delivery_hours)
+        for i, mask in enumerate(compile_slots(self.delivery_intervals)):
+            setattr(self, 'delivery_slots_%d' % i, mask)
+
+    def save(self, *args, **kwargs):
+        self.compile_hours()
+        super().save(*args, **kwargs)
+
+
+class ArchivedOrder(models.Model):
+    order_id = models.IntegerField(primary_key=True)
+    weight = models.FloatField()
+    region = models.IntegerField()
+    delivery_hours = models.JSONField()
+    courier = models.ForeignKey(
+        Courier, null=True, on_delete=models.SET_NULL, blank=True, related_name='archived_orders'
+    )
+    completed = models.BooleanField(default=True)
+    assign_time = models.DateTimeField(null=True, blank=True)
+    complete_time = models.DateTimeField()
+    archive_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['courier', 'complete_time', 'order_id'], name='archived_order_history_idx'),
+        ]
+
+
+class CourierRegionStats(models.Model):
+    courier = models.ForeignKey(Courier, on_delete=models.CASCADE, related_name='region_stats')
+    region = models.IntegerField()
+    completed_count = models.IntegerField(default=0)
+    delivery_seconds = models.FloatField(default=0)
+    last_complete_time = models.DateTimeField(null=True, blank=True)
+    archived_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['courier', 'region'], name='courier_region_stats_unique'),
+        ]
+
+
+class CourierRegion(models.Model):
+    courier = models.ForeignKey(Courier, on_delete=models.CASCADE, related_name='region_links')
+    region = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['courier', 'region'], name='courier_region_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['region', 'courier'], name='courier_region_region_idx'),
+        ]
+
+
+class CourierShift(models.Model):
+    courier = models.ForeignKey(Courier, on_delete=models.CASCADE, related_name='shifts')
+    start = models.IntegerField()
+    end = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start', 'end'], name='courier_shift_time_idx'),
+        ]
+
+
+def sync_schedule(couriers, replace=True, regions=True, shifts=True):
+    if regions:
+        if replace:
+            CourierRegion.objects.filter(courier__in=couriers).delete()
+        CourierRegion.objects.bulk_create(
+            [CourierRegion(courier=i, region=region) for i in couriers for region in set(i.regions or [])],
+            batch_size=500
+        )
+    if shifts:
+        if replace:
+            CourierShift.objects.filter(courier__in=couriers).delete()
+        CourierShift.objects.bulk_create(
+            [CourierShift(courier=i, start=start, end=end) for i in couriers for start, end in i.working_intervals],
+            batch_size=500
+        )